@@ -1,16 +1,58 @@
 import argparse
+import asyncio
+import bz2
+import concurrent.futures
+import cProfile
 import csv
+import functools
+import glob
+import gzip
+import hashlib
+import io
+import itertools
 import json
 import logging
+import lzma
+import mmap
+import multiprocessing
 import os
+import queue
+import re
 import shutil
+import sqlite3
+import struct
 import sys
 import tempfile
+import threading
+import time
 import uuid
 import zipfile
 
+from array import array
+from contextlib import ExitStack
+from contextlib import contextmanager
 from io import FileIO
+from json.decoder import scanstring
+from typing import IO
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
 from typing import Optional
+from typing import Tuple
+from typing import Union
+from typing import cast
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError:  # pragma: no cover - not available on Windows
+    resource = None
 
 logger = logging.getLogger("MindMeister")
 logger.setLevel(logging.DEBUG)
@@ -25,220 +67,4898 @@ ch.setFormatter(formatter)
 
 logger.addHandler(ch)
 
+MAP_FILE_NAME = "map.json"
+
+ID_SCHEMES = ("uuid", "node", "counter")
+
+# The csv output is written in chunks of about this many characters.
+DEFAULT_BUFFER_SIZE = 1 << 20
+# The number of rows formatted at a time.
+DEFAULT_BATCH_SIZE = 1024
+
+SINK_FORMATS = ("csv", "tsv", "ndjson")
+
+# The outputs that are compressed, by extension, with the default level of
+# the command line tool of each codec.
+COMPRESSION_LEVELS = {".gz": 6, ".bz2": 9, ".xz": 6}
+
+# How --shard-by splits the csv output.
+SHARD_MODES = ("branch", "rows")
+# The number of threads that close and checksum the finished shards.
+DEFAULT_SHARD_THREADS = 4
+
+# The largest .mind file the conversion server accepts.
+DEFAULT_MAX_UPLOAD = 100 << 20
+
+# The limits on the attachments extracted with --attachments, a larger total
+# size or a higher compression ratio is refused as a likely zip bomb.
+DEFAULT_MAX_ATTACHMENT_BYTES = 1 << 30
+DEFAULT_MAX_COMPRESSION_RATIO = 200
+# The number of threads that decompress attachments.
+DEFAULT_ATTACHMENT_THREADS = 4
+
+# The search index used by `mm2csv index` and `mm2csv search`.
+DEFAULT_INDEX_PATH = "mm2csv-index.db"
+
+# How often `mm2csv watch` looks for changed files, and how long a file must
+# stay the same before it is converted, in seconds.
+DEFAULT_POLL_INTERVAL = 1.0
+DEFAULT_SETTLE_SECONDS = 2.0
+
+# The size of the result cache before the least recently used files go.
+DEFAULT_CACHE_SIZE = 1 << 30
+# Change this when the csv output changes, to invalidate cached results.
+CACHE_VERSION = 2
+
+# The columns that come from the walk of the map, every other column is a
+# node field, with dots for nested fields e.g. task.effort.
+WALK_COLUMNS = ("numbers", "ids", "parent_id", "id", "depth", "leaf", "title")
+COLUMN_NAME = re.compile(r"[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)*")
+
+# Replaces line breaks, tabs and other control characters in the text of a
+# row by spaces.
+TEXT_TABLE = {code: " " for code in itertools.chain(range(32), [127])}
+
+# (node, parent_id, id, depth, numbers, has_children)
+Visit = Tuple[dict, str, str, int, str, bool]
+
+# A .mind file path, the bytes of a .mind file or a binary file object.
+MapSource = Union[str, bytes, IO[bytes]]
+# The bytes of a map.json file, a memoryview when it is memory mapped.
+MapBuffer = Union[bytes, memoryview]
+
+
+class Branch(NamedTuple):
+    """
+    A branch of a map that is converted on its own by a worker process, see
+    `MindMeisterExtractor.split_map`.
+    """
+
+    # The child indexes that lead from the root to the branch.
+    path: Tuple[int, ...]
+    parent_id: str
+    depth: int
+    numbers: str
+    # The counter id of the branch node.
+    first_id: int
+
+
+# The extractor and root node of the map a split worker process converts the
+# branches of, set in every worker by `_init_split_worker`.
+_split_map: Optional[Tuple[Any, dict]] = None
+
+
+def _init_split_worker(extractor: Any, root: dict):
+    global _split_map
+    _split_map = (extractor, root)
+
+
+def _write_branch(branch: Branch) -> str:
+    extractor, root = _split_map
+    return extractor.write_branch(root, branch)
+
 
 class ExtractorError(Exception):
     pass
 
 
-class MindMeisterExtractor:
+class MapTooDeepError(ExtractorError):
     """
-    This class will extract a .mind file and convert it to a flat .csv file.
+    Raised when a map is nested too deep for json.loads, such a map can
+    still be read with `MindMeisterExtractor.stream_walk`.
     """
 
-    def __init__(
-        self, print_numbers: bool, print_ids: bool, print_leaf_nodes: bool
-    ):
-        self.input_file: Optional[FileIO] = None
-        self.output_file: Optional[FileIO] = None
-        self.csv_writer: Optional[csv.writer] = None
-        self.print_numbers: bool = print_numbers
-        self.print_ids: bool = print_ids
-        self.print_leaf_nodes: bool = print_leaf_nodes
 
-    @staticmethod
-    def generate_id():
-        return str(uuid.uuid4())
+class JsonTokenizer:
+    """
+    A pull tokenizer that reads JSON text incrementally from a text stream.
+    Only the values that are asked for are decoded, everything else is
+    skipped over without building Python objects for it.
+    """
 
-    def init_csv_writer(self) -> csv.writer:
-        return csv.writer(
-            self.output_file,
-            delimiter=",",
-            quotechar='"',
-            quoting=csv.QUOTE_MINIMAL,
+    WHITESPACE = re.compile(r"[ \t\n\r]*")
+    SCALAR = re.compile(
+        r"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?|true|false|null"
+    )
+    STRING_BODY = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+    STRUCTURE = re.compile(r'["{}\[\]]')
+    DECODER = json.JSONDecoder()
+    KEY = re.compile(r'[ \t\n\r]*,?[ \t\n\r]*"([^"\\]*)"[ \t\n\r]*:')
+    SIMPLE_VALUE = re.compile(
+        r'[ \t\n\r]*(?:"[^"\\]*"|[-+.0-9eE]+|true|false|null'
+        r'|\{[^{}\[\]"]*(?:"[^"\\]*"[^{}\[\]"]*)*\}'
+        r'|\[[^{}\[\]"]*(?:"[^"\\]*"[^{}\[\]"]*)*\])[ \t\n\r]*'
+    )
+
+    def __init__(self, stream: IO[str], chunk_size: int = 1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+
+    def error(self, message: str) -> ExtractorError:
+        return ExtractorError(
+            f"Could not load the MindMeister map file, {message}, is this a "
+            "correct .mind file?"
         )
 
-    def parse(self, parent_id: str, depth: int, numbers: str, node: dict):
+    def fill(self) -> bool:
         """
-        This is a recursive function that is used to walk the Mind Meister
-        hierarchy and output the title with a number prefix.
+        Reads the next chunk from the stream, the consumed part of the buffer
+        is dropped so the buffer never holds more than one value.
 
-        :param depth: The current depth in the hierarchy.
-        :param numbers: The string of numbers for the current node
-                        e.g. '1.2.4.5'.
-        :param node: The node element currently processed, this is a dictionary.
+        :returns: False if the end of the stream was reached.
         """
-        id = self.generate_id()
-        has_children = False
+        chunk = self.stream.read(self.chunk_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos :] + chunk
+        self.pos = 0
+        return True
 
-        if "children" in node and len(node["children"]) > 0:
-            has_children = True
+    def peek(self) -> str:
+        """
+        :returns: The next character that is not whitespace, or an empty
+                  string at the end of the stream.
+        """
+        while True:
+            self.pos = self.WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill():
+                return ""
 
-        if "title" in node:
-            row = list()
+    def accept(self, char: str) -> bool:
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
 
-            if self.print_numbers:
-                row.append(numbers)
-            if self.print_ids:
-                row.append(".".join([parent_id, id]))
-            if self.print_leaf_nodes:
-                if not has_children:
-                    row.append("L")
-                else:
-                    row.append("")
+    def expect(self, char: str):
+        if not self.accept(char):
+            raise self.error(f"expected '{char}' at offset {self.pos}")
 
-            title = node["title"]
-            title = title.replace("\r", " ")
-            row.append(title)
-            self.csv_writer.writerow(row)
+    def read_string(self) -> str:
+        self.expect('"')
+        while True:
+            try:
+                value, self.pos = scanstring(self.buffer, self.pos)
+                return value
+            except ValueError:
+                # The string continues in the next chunk.
+                if not self.fill():
+                    raise self.error("unterminated string")
 
-        if has_children:
-            count = 1
+    def read_key(self) -> str:
+        """
+        Reads an object key and the colon that follows it, a comma before
+        the key is skipped.
+        """
+        match = self.KEY.match(self.buffer, self.pos)
+        if match and match.end() < len(self.buffer):
+            self.pos = match.end()
+            return match.group(1)
+        key = self.read_string()
+        self.expect(":")
+        return key
 
-            for child_node in node["children"]:
-                self.parse(
-                    parent_id=id,
-                    depth=depth + 1,
-                    numbers=f"{numbers}.{count}",
-                    node=child_node,
-                )
-                count += 1
+    def read_value(self) -> Any:
+        """
+        Reads a string, number, boolean or null value.
+        """
+        if self.peek() == '"':
+            return self.read_string()
+        while True:
+            match = self.SCALAR.match(self.buffer, self.pos)
+            # A value at the end of the buffer may continue in the next chunk.
+            if match:
+                truncated = match.end() == len(self.buffer)
+            else:
+                truncated = len(self.buffer) - self.pos < 8
+            if not (truncated and self.fill()):
+                break
+        if match is None:
+            raise self.error(f"unexpected value at offset {self.pos}")
+        self.pos = match.end()
+        return json.loads(match.group())
 
-    def unzip(self, file_path: str) -> str:
+    def read_any(self) -> Any:
+        """
+        Reads any value, objects and arrays are decoded whole.
         """
-        This will unzip the given file into a temporary folder.
+        if self.peek() not in ("{", "["):
+            return self.read_value()
+        while True:
+            try:
+                value, self.pos = self.DECODER.raw_decode(
+                    self.buffer, self.pos
+                )
+                return value
+            except ValueError:
+                # The value continues in the next chunk.
+                if not self.fill():
+                    raise self.error("unexpected end of file")
 
-        :param file_path: The path of the file to extract.
-        :returns: The path to the temporary folder that was extracted.
+    def skip_string_body(self):
+        while True:
+            match = self.STRING_BODY.match(self.buffer, self.pos)
+            if match:
+                self.pos = match.end()
+                return
+            if not self.fill():
+                raise self.error("unterminated string")
+
+    def skip_value(self):
+        """
+        Skips over the next value, objects and arrays are skipped by only
+        looking at their structural characters.
         """
-        temp_dir = tempfile.gettempdir()
-        dest_dir = os.path.join(temp_dir, "mindmeister")
+        match = self.SIMPLE_VALUE.match(self.buffer, self.pos)
+        if match and match.end() < len(self.buffer):
+            self.pos = match.end()
+            return
 
-        with zipfile.ZipFile(file_path) as zip_file:
-            for member in zip_file.infolist():
-                # Path traversal defense copied from
-                # http://hg.python.org/cpython/file/tip/Lib/http/server.py#l789
-                words = member.filename.split("/")
-                path = dest_dir
-                for word in words[:-1]:
-                    drive, word = os.path.splitdrive(word)
-                    head, word = os.path.split(word)
-                    if word in (os.curdir, os.pardir, ""):
-                        continue
-                    path = os.path.join(path, word)
-                zip_file.extract(member, path)
+        char = self.peek()
+        if char == '"':
+            self.pos += 1
+            self.skip_string_body()
+        elif char in ("{", "["):
+            self.skip_nested(0)
+        else:
+            self.read_value()
 
-        return dest_dir
+    def skip_nested(self, depth: int):
+        """
+        Skips to the end of the object or array that is `depth` levels up,
+        by only looking at the structural characters.
 
-    def convert(self, input_file_path: str, output_file_path: str):
+        :param depth: The number of objects and arrays the current position
+                      is in, 0 when it is at the start of one.
         """
-        Opens and parses the input file and if the data is in the correct
-        format it will produce a flat representation of the Mind Meister
-        hierarchy.
+        while True:
+            match = self.STRUCTURE.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self.fill():
+                    raise self.error("unexpected end of file")
+                continue
+            self.pos = match.end()
+            char = match.group()
+            if char == '"':
+                self.skip_string_body()
+            elif char in ("{", "["):
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    return
 
-        :param input_file_path: The file path of the .mind file to read from.
-        :param output_file_path: The file path of the .csv file to write to,
-                                 if this is an empty string it will print the
-                                 result to stdout.
-        :raises ExtractorError: An ExtractorError is raised with the data
-                                format is incorrect.
+
+@contextmanager
+def _no_phase(name: str) -> Iterator[None]:
+    yield
+
+
+def _tell(file: IO[bytes]) -> int:
+    try:
+        return file.tell()
+    except (OSError, ValueError):
+        return 0
+
+
+class ConversionStats:
+    """
+    The phase timings and counters of one conversion. Pass one to
+    `MindMeisterExtractor.write_csv`, or give the extractor an `on_stats`
+    callback, to find out where the time of a conversion goes.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Drops the timings and counters, e.g. of a conversion that is run
+        again.
         """
+        self.phases: Dict[str, float] = {}
+        self.bytes_read: int = 0
+        self.bytes_written: int = 0
+        self.nodes: int = 0
+        self.rows: int = 0
+        self.max_depth: int = 0
+        self.max_rss_bytes: Optional[int] = None
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
 
-        mind_meister_dir = None
+    def add_time(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
 
+    def count(self, visits: Iterator[Visit]) -> Iterator[Visit]:
+        """
+        Counts the visited nodes and rows as they pass through.
+        """
+        nodes = rows = max_depth = 0
         try:
-            mind_meister_dir = self.unzip(input_file_path)
-            self.input_file = open(os.path.join(mind_meister_dir, "map.json"))
+            for visit in visits:
+                nodes += 1
+                if visit[3] > max_depth:
+                    max_depth = visit[3]
+                if "title" in visit[0]:
+                    rows += 1
+                yield visit
+        finally:
+            self.nodes += nodes
+            self.rows += rows
+            self.max_depth = max(self.max_depth, max_depth)
 
-            if output_file_path != "":
-                self.output_file = open(output_file_path, "w")
-            else:
-                self.output_file = sys.stdout
+    def finish(self):
+        if resource is not None:
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # Linux reports kilobytes and macOS bytes.
+            self.max_rss_bytes = (
+                max_rss if sys.platform == "darwin" else max_rss * 1024
+            )
 
-            self.csv_writer = self.init_csv_writer()
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases": {
+                name: round(seconds, 6)
+                for name, seconds in self.phases.items()
+            },
+            "seconds": round(sum(self.phases.values()), 6),
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "nodes": self.nodes,
+            "rows": self.rows,
+            "max_depth": self.max_depth,
+            "max_rss_bytes": self.max_rss_bytes,
+        }
 
-            try:
-                data = json.load(self.input_file)
-            except ValueError:
-                raise ExtractorError(
-                    "Could not load the MindMeister map file, is this a "
-                    "correct .mind file?"
-                )
 
-            if "root" in data:
-                self.parse(
-                    parent_id=self.generate_id(),
-                    depth=0,
-                    numbers="1",
-                    node=data["root"],
-                )
-            else:
-                raise ExtractorError(
-                    "Incorrect data format, is this a correct .mind file?"
+class BufferedCsvWriter:
+    """
+    A csv writer that formats rows in batches into an in-memory buffer and
+    writes the buffer to the output in large chunks, so pipes and network
+    file systems see a few big writes instead of one small write per row.
+    The output is byte for byte the same as a plain csv.writer.
+    """
+
+    def __init__(
+        self,
+        output_file: IO[str],
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        stats: Optional[ConversionStats] = None,
+        delimiter: str = ",",
+    ):
+        self.output_file = output_file
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.stats = stats
+        self.buffer = io.StringIO()
+        self.csv_writer = csv.writer(
+            self.buffer,
+            delimiter=delimiter,
+            quotechar='"',
+            quoting=csv.QUOTE_MINIMAL,
+        )
+
+    def writerow(self, row: Iterable[str]):
+        self.csv_writer.writerow(row)
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+
+    def write_batch(self, rows: Iterable[Iterable[str]]) -> bool:
+        """
+        Formats rows into the buffer, the buffer is only written to the
+        output once it is full.
+
+        :returns: False if there were no rows.
+        """
+        start = self.buffer.tell()
+        self.csv_writer.writerows(rows)
+        # A row always writes at least a line ending.
+        written = self.buffer.tell() > start
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+        return written
+
+    def writerows(self, rows: Iterable[Iterable[str]]):
+        rows = iter(rows)
+        batch_size = self.batch_size
+        write_batch = self.write_batch
+
+        while write_batch(itertools.islice(rows, batch_size)):
+            pass
+
+        self.flush()
+
+    def write(self, text: str):
+        """
+        Adds text that is already formatted, e.g. rows formatted by another
+        writer, to the buffer.
+        """
+        self.buffer.write(text)
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer.tell():
+            return
+
+        if self.stats is None:
+            self.output_file.write(self.buffer.getvalue())
+        else:
+            with self.stats.phase("write"):
+                self.stats.bytes_written += self.output_file.write(
+                    self.buffer.getvalue()
                 )
+        self.buffer.seek(0)
+        self.buffer.truncate()
 
-        except IOError as error:
-            logger.error(f"File error: {error}")
 
-        finally:
-            if self.input_file:
-                self.input_file.close()
-            if self.output_file:
-                self.output_file.close()
-            if mind_meister_dir:
-                shutil.rmtree(mind_meister_dir)
+class BufferedNdjsonWriter(BufferedCsvWriter):
+    """
+    Writes rows as JSON Lines, one object per row, through the same large
+    buffer as `BufferedCsvWriter`.
+    """
 
+    def __init__(
+        self,
+        output_file: IO[str],
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        stats: Optional[ConversionStats] = None,
+    ):
+        super().__init__(output_file, buffer_size, batch_size, stats)
+        self.encode = json.JSONEncoder(ensure_ascii=False).encode
 
-def main():
-    args_parser = argparse.ArgumentParser(
-        description=(
-            "This extracts a Mind Meister .mind file and converts it to a "
-            "flat .csv file."
+    def writerow(self, row: Dict[str, Any]):
+        self.write_batch((row,))
+
+    def write_batch(self, rows: Iterable[Dict[str, Any]]) -> bool:
+        start = self.buffer.tell()
+        encode = self.encode
+        write = self.buffer.write
+        for row in rows:
+            write(encode(row))
+            write("\n")
+        written = self.buffer.tell() > start
+        if self.buffer.tell() >= self.buffer_size:
+            self.flush()
+        return written
+
+
+class CompressedTextFile:
+    """
+    A text file that is written compressed with gzip, bz2 or xz, picked by
+    the extension of the path. The text is encoded here and compressed on a
+    background thread, so the walk goes on while the previous chunks are
+    compressed. The codecs release the GIL while they compress.
+
+    Writes should be large, e.g. the chunks of a `BufferedCsvWriter`, at most
+    `queue_size` of them wait for the compressor before a write blocks.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        level: Optional[int] = None,
+        encoding: str = "utf-8",
+        queue_size: int = 4,
+    ):
+        """
+        :param path: The path of the file, ending in .gz, .bz2 or .xz.
+        :param level: The compression level, see `COMPRESSION_LEVELS` for
+                      the defaults.
+        :param encoding: The encoding of the text.
+        :param queue_size: The number of writes that may wait to be
+                           compressed.
+        :raises ExtractorError: If the extension is not a compressed one.
+        """
+        extension = os.path.splitext(path)[1]
+        if extension not in COMPRESSION_LEVELS:
+            raise ExtractorError(f"Can not compress {path}.")
+        if level is None:
+            level = COMPRESSION_LEVELS[extension]
+
+        self.encoding = encoding
+        if extension == ".gz":
+            # Without a timestamp the same csv compresses to the same file.
+            self.file: IO[bytes] = gzip.GzipFile(
+                path, "wb", compresslevel=level, mtime=0
+            )
+        elif extension == ".bz2":
+            self.file = bz2.BZ2File(path, "wb", compresslevel=level)
+        else:
+            self.file = lzma.LZMAFile(path, "wb", preset=level)
+        self.queue: "queue.Queue[Optional[bytes]]" = queue.Queue(queue_size)
+        self.error: Optional[BaseException] = None
+        self.closed = False
+        self.thread = threading.Thread(
+            target=self.compress, name=f"compress {path}", daemon=True
         )
+        self.thread.start()
+
+    def compress(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            # After an error the queue is still drained, so writers do not
+            # block, and the error is raised by the next write.
+            if self.error is None:
+                try:
+                    self.file.write(data)
+                except BaseException as error:
+                    self.error = error
+
+    def write(self, text: str) -> int:
+        if self.error is not None:
+            raise self.error
+        self.queue.put(text.encode(self.encoding))
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """
+        Waits for the compressor to finish and closes the file.
+
+        :raises IOError: If the file could not be written.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+    def __enter__(self) -> "CompressedTextFile":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output(path: str, compression_level: Optional[int] = None) -> IO[str]:
+    """
+    Opens an output file for writing, a .gz, .bz2 or .xz file is compressed
+    with a `CompressedTextFile`.
+
+    :param path: The path of the output file.
+    :param compression_level: The compression level of a compressed file.
+    """
+    if os.path.splitext(path)[1] in COMPRESSION_LEVELS:
+        return cast(IO[str], CompressedTextFile(path, compression_level))
+    return open(path, "w")
+
+
+@contextmanager
+def replace_output(
+    path: str, compression_level: Optional[int] = None
+) -> Iterator[IO[str]]:
+    """
+    Opens an output file like `open_output`, but the text goes to a temporary
+    file next to it that only replaces the file when the block succeeds, so
+    a failed conversion leaves the last good output in place.
+
+    :param path: The path of the output file.
+    :param compression_level: The compression level of a compressed file.
+    """
+    directory, name = os.path.split(path)
+    # The same extension, so the temporary file is compressed the same way.
+    temp_path = os.path.join(
+        directory,
+        f".{name}.{uuid.uuid4().hex}.tmp{os.path.splitext(name)[1]}",
     )
-    args_parser.add_argument(
-        "file", help="The .mind file to convert.",
-    )
-    args_parser.add_argument(
-        "--output",
-        type=str,
-        nargs=1,
-        default=[""],
-        help="The .csv file to save to.",
-    )
-    args_parser.add_argument(
-        "--numbers",
-        help="Print hierarchy numbers for each item e.g. 1.2.3 (False).",
-        action="store_true",
-    )
-    args_parser.add_argument(
-        "--ids",
-        help=(
-            "Generate parent child ids to retain hierarchy relationships "
-            "(False)."
-        ),
-        action="store_true",
-    )
-    args_parser.add_argument(
-        "--leaf",
-        help="Mark leaf nodes with an 'L' (False).",
-        action="store_true",
+    try:
+        with open_output(temp_path, compression_level) as file:
+            yield file
+        try:
+            shutil.copymode(path, temp_path)
+        except FileNotFoundError:
+            pass
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def default_columns(
+    print_numbers: bool, print_ids: bool, print_leaf_nodes: bool
+) -> List[str]:
+    """
+    :returns: The columns of the --numbers, --ids and --leaf options.
+    """
+    columns = ["numbers"] if print_numbers else []
+    if print_ids:
+        columns.append("ids")
+    if print_leaf_nodes:
+        columns.append("leaf")
+    columns.append("title")
+    return columns
+
+
+def parse_columns(text: str) -> List[str]:
+    """
+    Parses a comma separated list of columns e.g. 'numbers,title,note'.
+
+    :raises ExtractorError: If a column name is not valid.
+    """
+    columns = [column.strip() for column in text.split(",")]
+    for column in columns:
+        check_column(column)
+    return columns
+
+
+def check_column(column: str):
+    if not COLUMN_NAME.fullmatch(column):
+        raise ExtractorError(
+            f"Incorrect column '{column}', use {', '.join(WALK_COLUMNS)} "
+            "or a node field e.g. note or task.effort."
+        )
+
+
+def clean_text(value: Any) -> str:
+    """
+    Formats a node field for a csv row. Control characters in text are
+    replaced by spaces, other values are written as JSON.
+    """
+    if value is None:
+        return ""
+    if not isinstance(value, str):
+        return json.dumps(value)
+    return value if value.isprintable() else value.translate(TEXT_TABLE)
+
+
+def clean_value(value: Any) -> Any:
+    """
+    Formats a node field for an NDJSON row, only text is changed.
+    """
+    if isinstance(value, str) and not value.isprintable():
+        return value.translate(TEXT_TABLE)
+    return value
+
+
+def node_field(node: dict, path: Tuple[str, ...]) -> Any:
+    for name in path:
+        if not isinstance(node, dict):
+            return None
+        node = node.get(name)
+    return node
+
+
+@functools.lru_cache(maxsize=None)
+def compile_row_builder(
+    columns: Tuple[str, ...], format: str = "csv"
+) -> Callable[..., Any]:
+    """
+    Generates the function that makes the row of a visited node, so which
+    columns to write is decided once and not for every node.
+
+    :param columns: The column names, see `WALK_COLUMNS`.
+    :param format: 'csv' for rows that are lists of text, or 'ndjson' for
+                   rows that are dictionaries.
+    :returns: A function of the fields of a `Visit` that returns the row.
+    :raises ExtractorError: If a column name is not valid.
+    """
+    ndjson = format == "ndjson"
+    fields = []
+    for column in columns:
+        check_column(column)
+        if column == "numbers":
+            fields.append(("number", "numbers"))
+        elif column == "ids":
+            if ndjson:
+                fields.extend([("parent_id", "parent_id"), ("id", "id")])
+            else:
+                fields.append(("ids", 'f"{parent_id}.{id}"'))
+        elif column in ("parent_id", "id"):
+            fields.append((column, column))
+        elif column == "depth":
+            fields.append((column, "depth" if ndjson else "str(depth)"))
+        elif column == "leaf":
+            leaf = "'' if has_children else 'L'"
+            fields.append((column, "not has_children" if ndjson else leaf))
+        elif column == "title":
+            fields.append(
+                (
+                    column,
+                    "title if title.isprintable() "
+                    "else title.translate(TEXT_TABLE)",
+                )
+            )
+        else:
+            path = tuple(column.split("."))
+            value = (
+                f"node.get({path[0]!r})"
+                if len(path) == 1
+                else f"node_field(node, {path!r})"
+            )
+            clean = "clean_value" if ndjson else "clean_text"
+            fields.append((column, f"{clean}({value})"))
+
+    if ndjson:
+        row = ", ".join(f"{name!r}: {value}" for name, value in fields)
+        row = f"{{{row}}}"
+    else:
+        row = "[" + ", ".join(value for _, value in fields) + "]"
+    source = (
+        "def build_row(node, parent_id, id, depth, numbers, has_children):\n"
+        + ('    title = node["title"]\n' if "title" in columns else "")
+        + f"    return {row}\n"
     )
-    args = args_parser.parse_args()
+    namespace = {
+        "TEXT_TABLE": TEXT_TABLE,
+        "clean_text": clean_text,
+        "clean_value": clean_value,
+        "node_field": node_field,
+    }
+    exec(compile(source, f"<columns {','.join(columns)}>", "exec"), namespace)
+    return namespace["build_row"]
 
-    extractor = MindMeisterExtractor(
-        print_numbers=args.numbers,
-        print_ids=args.ids,
-        print_leaf_nodes=args.leaf,
+
+def stream_fields(columns: Iterable[str]) -> List[str]:
+    """
+    :returns: The node fields `stream_walk` has to decode for the columns.
+    """
+    fields = {"title", "id"}
+    fields.update(
+        column.partition(".")[0]
+        for column in columns
+        if column not in WALK_COLUMNS
     )
+    return sorted(fields)
 
-    try:
-        extractor.convert(
-            input_file_path=args.file, output_file_path=args.output[0]
-        )
 
-    except ExtractorError as error:
+def csv_rows(
+    visits: Iterable[Visit],
+    print_numbers: bool = False,
+    print_ids: bool = False,
+    print_leaf_nodes: bool = False,
+    columns: Optional[List[str]] = None,
+) -> Iterator[List[str]]:
+    """
+    Makes a row with the `columns`, by default the title with a number
+    prefix, for every visited node that has a title.
+    """
+    if columns is None:
+        columns = default_columns(print_numbers, print_ids, print_leaf_nodes)
+    build_row = compile_row_builder(tuple(columns))
+
+    for visit in visits:
+        if "title" in visit[0]:
+            yield build_row(*visit)
+
+
+def ndjson_rows(
+    visits: Iterable[Visit],
+    print_numbers: bool = False,
+    print_ids: bool = False,
+    print_leaf_nodes: bool = False,
+    columns: Optional[List[str]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    The same as `csv_rows` but every row is an object, ids are split into
+    'parent_id' and 'id' and the leaf flag is a boolean.
+    """
+    if columns is None:
+        columns = default_columns(print_numbers, print_ids, print_leaf_nodes)
+    build_row = compile_row_builder(tuple(columns), "ndjson")
+
+    for visit in visits:
+        if "title" in visit[0]:
+            yield build_row(*visit)
+
+
+def include_branches(
+    visits: Iterable[Visit], pattern: "re.Pattern"
+) -> Iterator[Visit]:
+    """
+    Keeps the branches of the nodes with a title that matches `pattern`,
+    together with the ancestors of those nodes so the hierarchy stays
+    complete. Nodes that are left out are still walked, to find the matches
+    below them, but are never formatted or written.
+    """
+    search = pattern.search
+    # The ancestors of the current node that have not been kept yet.
+    path: List[Visit] = []
+    branch_depth = None
+
+    for visit in visits:
+        depth = visit[3]
+        if branch_depth is not None:
+            if depth > branch_depth:
+                yield visit
+                continue
+            branch_depth = None
+        while path and path[-1][3] >= depth:
+            path.pop()
+        if search(visit[0].get("title", "")):
+            yield from path
+            path.clear()
+            branch_depth = depth
+            yield visit
+        else:
+            path.append(visit)
+
+
+class Sink:
+    """
+    One output of `MindMeisterExtractor.write_sinks`, with its own format and
+    columns. Many sinks are fed from a single walk of the map.
+    """
+
+    def __init__(
+        self,
+        output_file: IO[str],
+        format: str = "csv",
+        print_numbers: bool = False,
+        print_ids: bool = False,
+        print_leaf_nodes: bool = False,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        columns: Optional[List[str]] = None,
+    ):
+        if format not in SINK_FORMATS:
+            raise ExtractorError(
+                f"Unknown output format '{format}', use one of "
+                f"{', '.join(SINK_FORMATS)}."
+            )
+
+        self.format = format
+        self.columns = columns or default_columns(
+            print_numbers, print_ids, print_leaf_nodes
+        )
+        compile_row_builder(tuple(self.columns), format)
+        if format == "ndjson":
+            self.writer = BufferedNdjsonWriter(output_file, buffer_size)
+            self.rows = ndjson_rows
+        else:
+            self.writer = BufferedCsvWriter(
+                output_file,
+                buffer_size,
+                delimiter="\t" if format == "tsv" else ",",
+            )
+            self.rows = csv_rows
+
+    @staticmethod
+    def parse_spec(spec: str) -> Tuple[str, str, Dict[str, bool]]:
+        """
+        Parses a 'FORMAT:PATH[:COLUMNS]' sink description from the command
+        line, where COLUMNS is a comma separated list of numbers, ids and
+        leaf e.g. 'csv:out.csv:numbers,leaf' to add to the title. Any other
+        column makes it the full list of columns, see `--columns`.
+
+        :returns: The format, the path and the Sink column options.
+        """
+        format, _, rest = spec.partition(":")
+        path, _, columns = rest.rpartition(":")
+        if not path:
+            path, columns = rest, ""
+        names = {"numbers": "print_numbers", "ids": "print_ids"}
+        names["leaf"] = "print_leaf_nodes"
+        options: Dict[str, Any] = {}
+        for column in filter(None, columns.split(",")):
+            if column not in names:
+                options = {"columns": parse_columns(columns)}
+                break
+            options[names[column]] = True
+        if format not in SINK_FORMATS or not path:
+            raise ExtractorError(
+                f"Incorrect output '{spec}', use FORMAT:PATH[:COLUMNS] with "
+                f"FORMAT one of {', '.join(SINK_FORMATS)}."
+            )
+        return format, path, options
+
+    def write(self, visits: List[Visit]):
+        self.writer.write_batch(self.rows(visits, columns=self.columns))
+
+    def flush(self):
+        self.writer.flush()
+
+
+def file_digest(file_path: str) -> "hashlib._Hash":
+    """
+    :returns: The sha256 digest of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest
+
+
+class SqliteSink:
+    """
+    An output of `MindMeisterExtractor.write_sinks` that inserts the visited
+    nodes into a SQLite database, in batches and in a single transaction.
+
+    The nodes table has a row per node, numbered in the order of the map,
+    with the node id, parent id, row of the parent, depth, outline number,
+    leaf flag and title. The closure table, when asked for, has a row for
+    every ancestor and descendant pair with the distance between them, so
+    subtrees and ancestors are found with a join instead of a recursive
+    query. Tables from an earlier export are replaced.
+    """
+
+    # The node fields to decode when streaming, see `stream_fields`.
+    columns = ["title"]
+
+    def __init__(self, path: str, closure: bool = False):
+        self.closure = closure
+        self.count = 0
+        self.base_depth: Optional[int] = None
+        # The rows of the ancestors of the current node, by depth.
+        self.path: List[int] = []
+        try:
+            self.connection = sqlite3.connect(path, isolation_level=None)
+            self.connection.execute("BEGIN")
+            for table in ("nodes", "closure"):
+                self.connection.execute(f"DROP TABLE IF EXISTS {table}")
+            self.connection.execute(
+                "CREATE TABLE nodes (row INTEGER PRIMARY KEY, id TEXT, "
+                "parent_id TEXT, parent INTEGER, depth INTEGER, number TEXT, "
+                "leaf INTEGER, title TEXT)"
+            )
+            if closure:
+                self.connection.execute(
+                    "CREATE TABLE closure (ancestor INTEGER, descendant "
+                    "INTEGER, distance INTEGER, PRIMARY KEY (ancestor, "
+                    "descendant)) WITHOUT ROWID"
+                )
+        except sqlite3.Error as error:
+            raise ExtractorError(f"Could not create {path}: {error}")
+
+    def write(self, visits: List[Visit]):
+        rows = []
+        closure: List[Tuple[int, int, int]] = []
+        path = self.path
+        if self.base_depth is None and visits:
+            self.base_depth = visits[0][3]
+
+        for node, parent_id, id, depth, numbers, has_children in visits:
+            self.count += 1
+            row = self.count
+            level = depth - self.base_depth
+            del path[level:]
+            rows.append(
+                (
+                    row,
+                    id,
+                    parent_id,
+                    path[-1] if path else None,
+                    depth,
+                    numbers,
+                    not has_children,
+                    node.get("title"),
+                )
+            )
+            if self.closure:
+                closure.append((row, row, 0))
+                closure.extend(
+                    (ancestor, row, level - distance)
+                    for distance, ancestor in enumerate(path)
+                )
+            path.append(row)
+
+        self.connection.executemany(
+            "INSERT INTO nodes VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        if closure:
+            self.connection.executemany(
+                "INSERT INTO closure VALUES (?, ?, ?)", closure
+            )
+
+    def flush(self):
+        """
+        Indexes the tables and commits the export.
+        """
+        self.connection.execute("CREATE INDEX nodes_parent ON nodes (parent)")
+        self.connection.execute("CREATE INDEX nodes_id ON nodes (id)")
+        if self.closure:
+            self.connection.execute(
+                "CREATE INDEX closure_descendant ON closure (descendant)"
+            )
+        self.connection.execute("COMMIT")
+        self.close()
+
+    def close(self):
+        """
+        Closes the database, an export that was not flushed is rolled back.
+        """
+        self.connection.close()
+
+
+class ShardSink:
+    """
+    An output of `MindMeisterExtractor.write_sinks` that splits the csv rows
+    over many files, each with its own buffered writer:
+
+    - branch: A file for the root and one for every branch below the root,
+      named by the outline number and title e.g. map-1.2-Budget_2024.csv.
+    - rows: Files of at most `shard_rows` rows, numbered from 1 e.g.
+      map-0001.csv. A node with children does not end a file, so the first
+      row of a branch is never cut off from the rows below it. Only a run
+      of nested first rows longer than a whole shard is split.
+
+    Finished shards are closed, which waits for a compressed file to be
+    written, and checksummed on a few threads while the walk goes on. The
+    manifest, e.g. map.manifest.json, lists every shard with its row count
+    and sha256.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        shard_by: str = "branch",
+        shard_rows: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        compression_level: Optional[int] = None,
+    ):
+        """
+        :param path: The path the shard names are made from, a .gz, .bz2 or
+                     .xz extension compresses every shard.
+        :param shard_by: One of `SHARD_MODES`.
+        :param shard_rows: The most rows in a shard when sharding by rows.
+        :param columns: The columns to write, the title by default.
+        :param buffer_size: The size of the chunks written to a shard.
+        :param compression_level: The level of compressed shards.
+        :raises ExtractorError: If the options are not valid.
+        """
+        if shard_by not in SHARD_MODES:
+            raise ExtractorError(
+                f"Unknown shard mode '{shard_by}', use one of "
+                f"{', '.join(SHARD_MODES)}."
+            )
+        if shard_by == "rows" and (shard_rows is None or shard_rows < 1):
+            raise ExtractorError("Sharding by rows needs a row count of 1+.")
+
+        self.shard_by = shard_by
+        self.shard_rows = shard_rows
+        self.columns = columns or ["title"]
+        self.build_row = compile_row_builder(tuple(self.columns))
+        self.buffer_size = buffer_size
+        self.compression_level = compression_level
+        base, extension = os.path.splitext(path)
+        if extension in COMPRESSION_LEVELS:
+            base, csv_extension = os.path.splitext(base)
+            extension = csv_extension + extension
+        self.base = base
+        self.extension = extension
+        self.manifest_path = f"{base}.manifest.json"
+        self.base_depth: Optional[int] = None
+        self.output_file: Optional[IO[str]] = None
+        self.writer: Optional[BufferedCsvWriter] = None
+        self.rows = 0
+        # The rows of nodes with children that wait for the next row without
+        # children before a shard is picked for them.
+        self.held: List[Tuple[List[str], dict, str]] = []
+        self.shards: List[Dict[str, Any]] = []
+        self.finished: List["concurrent.futures.Future"] = []
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            DEFAULT_SHARD_THREADS
+        )
+
+    def shard_path(self, node: dict, numbers: str) -> str:
+        if self.shard_by == "rows":
+            return f"{self.base}-{len(self.shards) + 1:04d}{self.extension}"
+        title = re.sub(r"\W+", "_", str(node.get("title", ""))).strip("_")
+        title = title[:40] or "untitled"
+        return f"{self.base}-{numbers}-{title}{self.extension}"
+
+    def open_shard(self, node: dict, numbers: str):
+        self.finish_shard()
+        path = self.shard_path(node, numbers)
+        self.output_file = open_output(path, self.compression_level)
+        self.writer = BufferedCsvWriter(self.output_file, self.buffer_size)
+        self.rows = 0
+        self.shards.append({"path": os.path.basename(path), "first": numbers})
+
+    def finish_shard(self):
+        if self.writer is None:
+            return
+        self.writer.flush()
+        self.shards[-1]["rows"] = self.rows
+        output_file = self.output_file
+        path = os.path.join(
+            os.path.dirname(self.base), self.shards[-1]["path"]
+        )
+
+        def finish() -> str:
+            output_file.close()
+            return file_digest(path).hexdigest()
+
+        self.finished.append(self.executor.submit(finish))
+        self.output_file = self.writer = None
+
+    def write(self, visits: List[Visit]):
+        if self.base_depth is None and visits:
+            self.base_depth = visits[0][3]
+        build_row = self.build_row
+
+        for visit in visits:
+            node, _, _, depth, numbers, has_children = visit
+            if "title" not in node:
+                continue
+            if self.shard_by == "branch":
+                if self.writer is None or depth <= self.base_depth + 1:
+                    self.open_shard(node, numbers)
+                self.writer.writerow(build_row(*visit))
+                self.rows += 1
+                continue
+            self.held.append((build_row(*visit), node, numbers))
+            if not has_children:
+                self.write_held()
+
+    def write_held(self):
+        """
+        Writes the held rows, up to and including a row without children, to
+        the current shard if they all fit and to a new shard otherwise.
+        """
+        held = self.held
+        shard_rows = self.shard_rows
+        if (
+            self.writer is not None
+            and self.rows + len(held) > shard_rows
+            and len(held) <= shard_rows
+        ):
+            self.finish_shard()
+        for row, node, numbers in held:
+            if self.writer is None or self.rows >= shard_rows:
+                self.open_shard(node, numbers)
+            self.writer.writerow(row)
+            self.rows += 1
+        held.clear()
+
+    def flush(self):
+        """
+        Finishes the shards and writes the manifest.
+
+        :raises IOError: If a shard could not be written.
+        """
+        if self.held:
+            self.write_held()
+        self.finish_shard()
+        for shard, finished in zip(self.shards, self.finished):
+            shard["sha256"] = finished.result()
+        self.executor.shutdown()
+
+        with open(self.manifest_path, "w") as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=2)
+            manifest_file.write("\n")
+
+    @property
+    def manifest(self) -> Dict[str, Any]:
+        return {
+            "shard_by": self.shard_by,
+            "columns": self.columns,
+            "rows": sum(shard.get("rows", 0) for shard in self.shards),
+            "shards": self.shards,
+        }
+
+    def close(self):
+        """
+        Closes the open shard, a sink that was not flushed leaves its shards
+        unfinished.
+        """
+        if self.output_file is not None:
+            self.output_file.close()
+        self.executor.shutdown()
+
+
+class ResultCache:
+    """
+    An on-disk cache of converted .csv files keyed by the content hash of the
+    .mind file and the options that change the output. When the cache holds
+    more than `max_bytes` the least recently used files are removed.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_CACHE_SIZE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, file_path: str, options: Dict[str, Any]) -> str:
+        """
+        :param file_path: The .mind file.
+        :param options: The options that change the output.
+        :returns: The cache key of the converted file.
+        """
+        digest = file_digest(file_path)
+        digest.update(
+            json.dumps([CACHE_VERSION, options], sort_keys=True).encode()
+        )
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.csv")
+
+    def open(self, key: str) -> Optional[IO[str]]:
+        """
+        :returns: The cached .csv file opened for reading, or None if the key
+                  is not in the cache.
+        """
+        path = self.path(key)
+        try:
+            file = open(path, newline="")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return file
+
+    @contextmanager
+    def put(self, key: str) -> Iterator[IO[str]]:
+        """
+        Opens a file to write the .csv output for a key to. The file only
+        enters the cache when the block succeeds.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        descriptor, temp_path = tempfile.mkstemp(
+            suffix=".tmp", dir=self.directory
+        )
+        try:
+            with open(descriptor, "w", newline="") as file:
+                yield file
+            os.replace(temp_path, self.path(key))
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        self.evict()
+
+    def entries(self) -> List[Tuple[float, int, str]]:
+        """
+        :returns: (access time, size, path) tuples of the cached files.
+        """
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(".csv"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        entries = sorted(self.entries())
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+
+def _member_path(dest_dir: str, name: str) -> str:
+    """
+    :returns: The path to extract an archive member to, without the parts of
+              the name that could leave the folder.
+    """
+    path = dest_dir
+    for word in name.split("/"):
+        drive, word = os.path.splitdrive(word)
+        head, word = os.path.split(word)
+        if word in (os.curdir, os.pardir, ""):
+            continue
+        path = os.path.join(path, word)
+    return path
+
+
+class AttachmentExporter:
+    """
+    Extracts only the archive members that the 'attachments' and 'image'
+    fields of the visited nodes refer to, and gives every node the paths of
+    its files in an 'attachment_files' field for the csv column.
+
+    Nothing is written until the walk is done. Then the declared sizes of
+    all the members are checked against the limits and the members are
+    decompressed in parallel threads, zlib releases the GIL.
+    """
+
+    def __init__(
+        self,
+        zip_file: zipfile.ZipFile,
+        dest_dir: str,
+        threads: int = DEFAULT_ATTACHMENT_THREADS,
+        max_bytes: int = DEFAULT_MAX_ATTACHMENT_BYTES,
+        max_ratio: float = DEFAULT_MAX_COMPRESSION_RATIO,
+    ):
+        self.zip_file = zip_file
+        self.dest_dir = dest_dir
+        self.threads = threads
+        self.max_bytes = max_bytes
+        self.max_ratio = max_ratio
+        self.names = set(zip_file.namelist())
+        # Member name -> the path it is extracted to.
+        self.members: Dict[str, str] = {}
+
+    def find_members(self, node: dict) -> Iterator[str]:
+        """
+        :returns: The archive members of the attachments and image of a node.
+        """
+        references = node.get("attachments") or []
+        image = node.get("image")
+        if isinstance(image, dict):
+            references = itertools.chain(references, [image])
+
+        for reference in references:
+            if not isinstance(reference, dict):
+                continue
+            id = reference.get("id")
+            file_name = reference.get("file_name") or reference.get("name")
+            if not file_name:
+                continue
+            for name in (
+                f"attachments/{id}/{file_name}",
+                f"images/{id}/{file_name}",
+                f"attachments/{file_name}",
+                f"images/{file_name}",
+                file_name,
+            ):
+                if name in self.names:
+                    yield name
+                    break
+
+    def attach(self, visits: Iterable[Visit]) -> Iterator[Visit]:
+        members = self.members
+        for visit in visits:
+            node = visit[0]
+            if node.get("attachments") or node.get("image"):
+                paths = []
+                for name in self.find_members(node):
+                    path = members.get(name)
+                    if path is None:
+                        path = members[name] = _member_path(
+                            self.dest_dir, name
+                        )
+                    paths.append(path)
+                node["attachment_files"] = ";".join(paths)
+            yield visit
+
+    def check(self) -> List[zipfile.ZipInfo]:
+        """
+        Checks the members against the limits before anything is written.
+
+        :returns: The members to extract.
+        :raises ExtractorError: If a limit is exceeded.
+        """
+        infos = [self.zip_file.getinfo(name) for name in self.members]
+        total = sum(info.file_size for info in infos)
+        if total > self.max_bytes:
+            raise ExtractorError(
+                f"The attachments are {total} bytes, more than the "
+                f"{self.max_bytes} bytes allowed."
+            )
+        for info in infos:
+            ratio = info.file_size / max(info.compress_size, 1)
+            if ratio > self.max_ratio:
+                raise ExtractorError(
+                    f"The attachment {info.filename} is compressed "
+                    f"{ratio:.0f} times, more than the {self.max_ratio} "
+                    "allowed."
+                )
+        return infos
+
+    def extract(self):
+        """
+        Extracts the attachments found by `attach`.
+
+        :raises ExtractorError: If a limit is exceeded.
+        """
+        infos = self.check()
+        if not infos:
+            return
+        with concurrent.futures.ThreadPoolExecutor(self.threads) as executor:
+            for _ in executor.map(self.extract_member, infos):
+                pass
+        logger.debug(f"Extracted {len(infos)} attachments to {self.dest_dir}")
+
+    def extract_member(self, info: zipfile.ZipInfo):
+        path = self.members[info.filename]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # The archive never gives more than the declared size of a member.
+        with self.zip_file.open(info) as source, open(path, "wb") as target:
+            shutil.copyfileobj(source, target, DEFAULT_BUFFER_SIZE)
+
+
+class MapSnapshot:
+    """
+    A compact record of a map that is enough to find what changed in a later
+    version of it. For every node, in the order of the map, it keeps the
+    node id, parent id, position among its siblings, outline number, title,
+    the size of its subtree and a hash of its subtree. Equal subtree hashes
+    mean the ids, titles and order below a node did not change.
+    """
+
+    VERSION = 1
+
+    def __init__(self):
+        # id -> [parent_id, position, numbers, title, digest, size]
+        self.nodes: Dict[str, list] = {}
+        self.order: List[str] = []
+
+    @classmethod
+    def from_root(cls, root: dict) -> "MapSnapshot":
+        """
+        Builds a snapshot from the root node of a map, without recursion.
+        """
+        snapshot = cls()
+        nodes = []
+        children_of: List[List[int]] = []
+        stack = [(root, "", 0, "1")]
+
+        while stack:
+            node, parent_id, position, numbers = stack.pop()
+            # Nodes without an id are matched on their outline number.
+            id = node.get("id")
+            id = numbers if id is None else str(id)
+            index = len(nodes)
+            nodes.append([id, parent_id, position, numbers, node])
+            children_of.append([])
+            children = node.get("children") or ()
+            for count in range(len(children), 0, -1):
+                stack.append(
+                    (children[count - 1], index, count, f"{numbers}.{count}")
+                )
+
+        # Parents come before their children, so walking backwards every
+        # child hash is known before its parent needs it.
+        digests: List[bytes] = [b""] * len(nodes)
+        sizes = [1] * len(nodes)
+        for index in range(len(nodes) - 1, -1, -1):
+            id, parent, position, numbers, node = nodes[index]
+            title = node.get("title")
+            digest = hashlib.blake2b(digest_size=16)
+            digest.update(f"{id}\x1f{title}\x1f".encode())
+            # The children were added last to first.
+            for child in reversed(children_of[index]):
+                digest.update(digests[child])
+                sizes[index] += sizes[child]
+            digests[index] = digest.digest()
+            if parent != "":
+                children_of[parent].append(index)
+
+        for index, (id, parent, position, numbers, node) in enumerate(nodes):
+            parent_id = nodes[parent][0] if parent != "" else ""
+            snapshot.nodes[id] = [
+                parent_id,
+                position,
+                numbers,
+                node.get("title"),
+                digests[index].hex(),
+                sizes[index],
+            ]
+            snapshot.order.append(id)
+
+        return snapshot
+
+    @classmethod
+    def load(cls, file_path: str) -> "MapSnapshot":
+        """
+        Loads a snapshot saved with `save`.
+        """
+        with open(file_path) as file:
+            data = json.load(file)
+        if data.get("version") != cls.VERSION:
+            raise ExtractorError(
+                f"{file_path} is not a snapshot of this mm2csv version."
+            )
+        snapshot = cls()
+        for row in data["nodes"]:
+            snapshot.nodes[row[0]] = row[1:]
+            snapshot.order.append(row[0])
+        return snapshot
+
+    def save(self, file_path: str):
+        with open(file_path, "w") as file:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "nodes": [[id] + self.nodes[id] for id in self.order],
+                },
+                file,
+                separators=(",", ":"),
+            )
+
+    def diff(self, old: "MapSnapshot") -> Iterator[Tuple[str, ...]]:
+        """
+        Compares this snapshot to an older one. Subtrees with the same hash
+        and place are skipped without looking at their nodes.
+
+        :param old: The snapshot of the older version of the map.
+        :returns: An iterator of (change, numbers, id, parent_id, title)
+                  tuples where change is one of 'added', 'removed', 'moved',
+                  'reparented' or 'retitled'. A node can have more than one
+                  change.
+        """
+        order = self.order
+        nodes = self.nodes
+        old_nodes = old.nodes
+        index = 0
+
+        while index < len(order):
+            id = order[index]
+            parent_id, position, numbers, title, digest, size = nodes[id]
+            old_node = old_nodes.get(id)
+            index += 1
+
+            if old_node is None:
+                yield "added", numbers, id, parent_id, title
+                continue
+
+            old_parent_id, old_position, _, old_title, old_digest, _ = old_node
+            if old_parent_id != parent_id:
+                yield "reparented", numbers, id, parent_id, title
+            elif old_position != position:
+                yield "moved", numbers, id, parent_id, title
+            if old_title != title:
+                yield "retitled", numbers, id, parent_id, title
+
+            if old_digest == digest:
+                # Nothing below this node changed.
+                index += size - 1
+
+        for id in old.order:
+            if id not in nodes:
+                parent_id, _, numbers, title, _, _ = old_nodes[id]
+                yield "removed", numbers, id, parent_id, title
+
+
+class MapTree:
+    """
+    A compact copy of the hierarchy of a map in parallel arrays, built once
+    and reused for every export and query without parsing the map again.
+
+    Nodes are numbered in the order of the map, so the subtree of node i is
+    the range i to end[i] - 1 and its children are found by jumping from
+    one child subtree to the next. Titles are interned in one table.
+    """
+
+    def __init__(self):
+        self.parent = array("l")
+        self.depth = array("l")
+        self.position = array("l")
+        self.end = array("l")
+        self.title_index = array("l")
+        self.node_id = array("q")
+        self.titles: List[str] = []
+        self.title_indexes: Dict[str, int] = {}
+
+    @classmethod
+    def from_visits(cls, visits: Iterable[Visit]) -> "MapTree":
+        """
+        Builds a tree in one pass from the nodes visited by `walk` or
+        `stream_walk`.
+        """
+        tree = cls()
+        parent = tree.parent
+        depths = tree.depth
+        positions = tree.position
+        title_index = tree.title_index
+        node_id = tree.node_id
+        titles = tree.titles
+        title_indexes = tree.title_indexes
+        # The last node index and the next child position at every depth.
+        last_at_depth: List[int] = []
+        next_position: List[int] = [1]
+
+        for index, (node, _, _, depth, _, _) in enumerate(visits):
+            del last_at_depth[depth:]
+            del next_position[depth + 1 :]
+            parent.append(last_at_depth[-1] if depth else -1)
+            depths.append(depth)
+            positions.append(next_position[depth])
+            next_position[depth] += 1
+            next_position.append(1)
+            last_at_depth.append(index)
+
+            title = node.get("title")
+            if title is None:
+                title_index.append(-1)
+            else:
+                interned = title_indexes.get(title)
+                if interned is None:
+                    interned = title_indexes[title] = len(titles)
+                    titles.append(title)
+                title_index.append(interned)
+
+            id = node.get("id")
+            node_id.append(id if isinstance(id, int) else -1)
+
+        # Children come after their parents, so walking backwards every
+        # subtree end is known before its parent needs it.
+        end = tree.end
+        end.extend(range(1, len(parent) + 1))
+        for index in range(len(parent) - 1, 0, -1):
+            if end[index] > end[parent[index]]:
+                end[parent[index]] = end[index]
+
+        return tree
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def title(self, index: int) -> Optional[str]:
+        title_index = self.title_index[index]
+        return None if title_index < 0 else self.titles[title_index]
+
+    def children(self, index: int) -> Iterator[int]:
+        child = index + 1
+        end = self.end[index]
+        while child < end:
+            yield child
+            child = self.end[child]
+
+    def ancestors(self, index: int) -> Iterator[int]:
+        """
+        :returns: The parents of a node, up to the root.
+        """
+        index = self.parent[index]
+        while index >= 0:
+            yield index
+            index = self.parent[index]
+
+    def numbers(self, index: int) -> str:
+        """
+        :returns: The outline number of a node e.g. '1.2.4'.
+        """
+        positions = [self.position[index]]
+        positions.extend(
+            self.position[parent] for parent in self.ancestors(index)
+        )
+        return ".".join(map(str, reversed(positions)))
+
+    def find(self, pattern: str) -> Iterator[int]:
+        """
+        :returns: The nodes with a title that matches the regular expression,
+                  each distinct title is only matched once.
+        """
+        search = re.compile(pattern).search
+        matches = {
+            index
+            for title, index in self.title_indexes.items()
+            if search(title)
+        }
+        return (
+            index
+            for index, title_index in enumerate(self.title_index)
+            if title_index in matches
+        )
+
+    def walk(
+        self, make_id: Callable[[dict], str], parent_id: str, start: int = 0
+    ) -> Iterator[Visit]:
+        """
+        Visits the subtree of a node like `MindMeisterExtractor.walk`.
+
+        :param make_id: The node id function, see `id_generator`.
+        :param parent_id: The id of the parent of the start node.
+        :param start: The node to start from.
+        """
+        if not len(self):
+            return
+
+        depth = self.depth
+        position = self.position
+        end = self.end
+        title_index = self.title_index
+        node_id = self.node_id
+        titles = self.titles
+        start_depth = depth[start]
+        numbers_at = {start_depth - 1: self.numbers(start).rpartition(".")[0]}
+        ids_at = {start_depth - 1: parent_id}
+
+        for index in range(start, end[start]):
+            node_depth = depth[index]
+            node: Dict[str, Any] = {}
+            if title_index[index] >= 0:
+                node["title"] = titles[title_index[index]]
+            if node_id[index] >= 0:
+                node["id"] = node_id[index]
+
+            parent_numbers = numbers_at[node_depth - 1]
+            numbers = (
+                f"{parent_numbers}.{position[index]}"
+                if parent_numbers
+                else str(position[index])
+            )
+            id = make_id(node)
+            numbers_at[node_depth] = numbers
+            ids_at[node_depth] = id
+
+            yield (
+                node,
+                ids_at[node_depth - 1],
+                id,
+                node_depth,
+                numbers,
+                end[index] > index + 1,
+            )
+
+
+class SearchHit(NamedTuple):
+    map_path: str
+    numbers: str
+    depth: int
+    node_id: str
+    title: str
+    path: List[str]
+
+
+class SearchIndex:
+    """
+    A SQLite full text (FTS5) index of the node titles of many maps. Every
+    node row has its outline number, depth, map and node id, and the row id
+    of its parent so the path of a hit back to the root is a few lookups.
+
+    The nodes of a map get consecutive row ids, so a changed map is removed
+    with one range delete and re-indexed, unchanged maps are skipped by the
+    hash of their content.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH):
+        self.path = path
+        self.extractor = MindMeisterExtractor(
+            print_numbers=True,
+            print_ids=True,
+            print_leaf_nodes=False,
+            id_scheme="counter",
+        )
+        self.connection = sqlite3.connect(path)
+        try:
+            self.create()
+        except sqlite3.OperationalError as error:
+            self.connection.close()
+            raise ExtractorError(f"Could not create the search index: {error}")
+
+    def create(self):
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version not in (0, self.VERSION):
+            raise ExtractorError(
+                f"The search index {self.path} is from another version of "
+                "mm2csv, remove it to index again."
+            )
+        with self.connection:
+            self.connection.executescript(
+                f"""
+                CREATE TABLE IF NOT EXISTS maps (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    name TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    first_node INTEGER NOT NULL,
+                    last_node INTEGER NOT NULL
+                );
+                CREATE VIRTUAL TABLE IF NOT EXISTS nodes USING fts5(
+                    title,
+                    map_id UNINDEXED,
+                    number UNINDEXED,
+                    depth UNINDEXED,
+                    node_id UNINDEXED,
+                    parent UNINDEXED,
+                    prefix = '2 3',
+                    tokenize = 'unicode61 remove_diacritics 2'
+                );
+                PRAGMA user_version = {self.VERSION};
+                """
+            )
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self) -> "SearchIndex":
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def remove(self, map_id: int):
+        first, last = self.connection.execute(
+            "SELECT first_node, last_node FROM maps WHERE id = ?", (map_id,)
+        ).fetchone()
+        self.connection.execute(
+            "DELETE FROM nodes WHERE rowid BETWEEN ? AND ?", (first, last)
+        )
+        self.connection.execute("DELETE FROM maps WHERE id = ?", (map_id,))
+
+    def add(self, file_path: str, force: bool = False) -> bool:
+        """
+        Indexes the nodes of a map, unless it is indexed already with the
+        same content.
+
+        :param file_path: The .mind file.
+        :param force: Index the map again even when it did not change.
+        :returns: True if the map was indexed, False if it was unchanged.
+        :raises ExtractorError: If the map could not be read.
+        """
+        file_path = os.path.abspath(file_path)
+        digest = file_digest(file_path).hexdigest()
+        row = self.connection.execute(
+            "SELECT id, hash FROM maps WHERE path = ?", (file_path,)
+        ).fetchone()
+        if row is not None and row[1] == digest and not force:
+            return False
+
+        with self.connection:
+            if row is not None:
+                self.remove(row[0])
+            # The row ids of the nodes are this offset plus their counter id,
+            # so the row id of the parent is known from the parent id.
+            offset = self.connection.execute(
+                "SELECT coalesce(max(last_node), 0) FROM maps"
+            ).fetchone()[0]
+            map_id = self.connection.execute(
+                "INSERT INTO maps (path, name, hash, first_node, last_node) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (
+                    file_path,
+                    os.path.splitext(os.path.basename(file_path))[0],
+                    digest,
+                    offset + 1,
+                    offset,
+                ),
+            ).lastrowid
+            ids = itertools.count(1)
+
+            def make_id(node: dict) -> str:
+                return str(next(ids))
+
+            with self.extractor.visit_map(file_path, True, make_id) as visits:
+                rows = (
+                    (
+                        offset + int(id),
+                        node.get("title", ""),
+                        map_id,
+                        numbers,
+                        depth,
+                        str(node.get("id", "")),
+                        offset + int(parent_id) if parent_id != "0" else None,
+                    )
+                    for node, parent_id, id, depth, numbers, _ in visits
+                )
+                while True:
+                    batch = list(itertools.islice(rows, DEFAULT_BATCH_SIZE))
+                    if not batch:
+                        break
+                    self.connection.executemany(
+                        "INSERT INTO nodes (rowid, title, map_id, number, "
+                        "depth, node_id, parent) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        batch,
+                    )
+            self.connection.execute(
+                "UPDATE maps SET last_node = ? WHERE id = ?",
+                (offset + next(ids) - 1, map_id),
+            )
+        return True
+
+    def prune(self) -> int:
+        """
+        Removes the maps whose files no longer exist.
+
+        :returns: The number of maps removed.
+        """
+        removed = [
+            map_id
+            for map_id, path in self.connection.execute(
+                "SELECT id, path FROM maps"
+            ).fetchall()
+            if not os.path.exists(path)
+        ]
+        with self.connection:
+            for map_id in removed:
+                self.remove(map_id)
+        return len(removed)
+
+    def search(self, query: str, limit: int = 20) -> List[SearchHit]:
+        """
+        Finds the nodes with a title that matches a FTS5 query e.g.
+        'budget', 'budget AND 2024' or 'bud*', best matches first.
+
+        :raises ExtractorError: If the query is not valid.
+        """
+        try:
+            hits = self.connection.execute(
+                "SELECT maps.path, nodes.number, nodes.depth, nodes.node_id, "
+                "nodes.title, nodes.parent FROM nodes "
+                "JOIN maps ON maps.id = nodes.map_id "
+                "WHERE nodes MATCH ? ORDER BY rank LIMIT ?",
+                (query, limit),
+            ).fetchall()
+        except sqlite3.OperationalError as error:
+            raise ExtractorError(f"Incorrect search '{query}': {error}")
+
+        results = []
+        for map_path, numbers, depth, node_id, title, parent in hits:
+            path = [title]
+            while parent is not None:
+                parent_title, parent = self.connection.execute(
+                    "SELECT title, parent FROM nodes WHERE rowid = ?",
+                    (parent,),
+                ).fetchone()
+                path.append(parent_title)
+            path.reverse()
+            results.append(
+                SearchHit(map_path, numbers, depth, node_id, title, path)
+            )
+        return results
+
+
+class ConversionResult(NamedTuple):
+    input_file_path: str
+    output_file_path: str
+    error: Optional[str]
+    seconds: float
+    size: int
+
+
+class BatchSummary:
+    """
+    The outcome of converting many .mind files with `convert_many`.
+    """
+
+    def __init__(self):
+        self.results: List[ConversionResult] = []
+        self.seconds: float = 0.0
+
+    @property
+    def succeeded(self) -> List[ConversionResult]:
+        return [result for result in self.results if result.error is None]
+
+    @property
+    def failed(self) -> List[ConversionResult]:
+        return [result for result in self.results if result.error is not None]
+
+    def __str__(self) -> str:
+        size = sum(result.size for result in self.results)
+        seconds = max(self.seconds, 1e-9)
+        return (
+            f"Converted {len(self.succeeded)} files, {len(self.failed)} "
+            f"failed in {self.seconds:.2f}s "
+            f"({len(self.results) / seconds:.1f} files/s, "
+            f"{size / seconds / 1e6:.2f} MB/s)"
+        )
+
+
+class MindMeisterExtractor:
+    """
+    This class will extract a .mind file and convert it to a flat .csv file.
+    """
+
+    def __init__(
+        self,
+        print_numbers: bool,
+        print_ids: bool,
+        print_leaf_nodes: bool,
+        id_scheme: str = "uuid",
+        on_stats: Optional[Callable[[ConversionStats], None]] = None,
+        max_depth: Optional[int] = None,
+        subtree: Optional[str] = None,
+        include: Optional[str] = None,
+        exclude: Optional[str] = None,
+        columns: Optional[Iterable[str]] = None,
+        attachments_dir: Optional[str] = None,
+        max_attachment_bytes: int = DEFAULT_MAX_ATTACHMENT_BYTES,
+        max_compression_ratio: float = DEFAULT_MAX_COMPRESSION_RATIO,
+    ):
+        if id_scheme not in ID_SCHEMES:
+            raise ExtractorError(
+                f"Unknown id scheme '{id_scheme}', use one of "
+                f"{', '.join(ID_SCHEMES)}."
+            )
+        if max_depth is not None and max_depth < 0:
+            raise ExtractorError("The maximum depth can not be negative.")
+
+        self.output_file: Optional[FileIO] = None
+        self.csv_writer: Optional[csv.writer] = None
+        self.print_numbers: bool = print_numbers
+        self.print_ids: bool = print_ids
+        self.print_leaf_nodes: bool = print_leaf_nodes
+        self.id_scheme: str = id_scheme
+        self.on_stats: Optional[Callable[[ConversionStats], None]] = on_stats
+        self.max_depth: Optional[int] = max_depth
+        self.subtree: Optional[str] = subtree
+        self.include: Optional[str] = include
+        self.exclude: Optional[str] = exclude
+        self.include_pattern = self.compile_pattern(include)
+        self.exclude_pattern = self.compile_pattern(exclude)
+        self.columns: List[str] = (
+            list(columns)
+            if columns
+            else default_columns(print_numbers, print_ids, print_leaf_nodes)
+        )
+        self.attachments_dir: Optional[str] = attachments_dir
+        self.max_attachment_bytes: int = max_attachment_bytes
+        self.max_compression_ratio: float = max_compression_ratio
+        if attachments_dir is not None:
+            if "attachment_files" not in self.columns:
+                self.columns.append("attachment_files")
+        compile_row_builder(tuple(self.columns))
+
+    @staticmethod
+    def compile_pattern(pattern: Optional[str]) -> Optional["re.Pattern"]:
+        if pattern is None:
+            return None
+        try:
+            return re.compile(pattern)
+        except re.error as error:
+            raise ExtractorError(
+                f"Incorrect title pattern '{pattern}': {error}"
+            )
+
+    @staticmethod
+    def generate_id():
+        return str(uuid.uuid4())
+
+    def id_generator(self) -> Callable[[dict], str]:
+        """
+        Returns the function that gives each node its id for the id scheme:
+
+        - uuid: A random uuid4 from `generate_id`.
+        - node: The map's own numeric 'id' field of the node.
+        - counter: A number that increases from 1 in the order of the rows.
+
+        The counter restarts for every generator, so a new one is needed for
+        every conversion.
+        """
+        if self.id_scheme == "node":
+            return lambda node: str(node.get("id", ""))
+        if self.id_scheme == "counter":
+            next_id = map(str, itertools.count(1)).__next__
+            return lambda node: next_id()
+        generate_id = self.generate_id
+        return lambda node: generate_id()
+
+    def root_parent_id(self) -> str:
+        """
+        :returns: The parent id to use for the root node.
+        """
+        if self.id_scheme == "uuid":
+            return self.generate_id()
+        return "0"
+
+    def output_options(self) -> Dict[str, Any]:
+        """
+        :returns: The options that change the csv output, used to key the
+                  result cache.
+        """
+        return {
+            "print_numbers": self.print_numbers,
+            "print_ids": self.print_ids,
+            "print_leaf_nodes": self.print_leaf_nodes,
+            "id_scheme": self.id_scheme,
+            "max_depth": self.max_depth,
+            "subtree": self.subtree,
+            "include": self.include,
+            "exclude": self.exclude,
+            "columns": self.columns,
+            "attachments_dir": self.attachments_dir,
+        }
+
+    @property
+    def is_deterministic(self) -> bool:
+        """
+        True if converting the same map twice gives the same output.
+        """
+        return not (self.print_ids and self.id_scheme == "uuid")
+
+    def init_csv_writer(self, output_file: Optional[IO[str]] = None):
+        return csv.writer(
+            output_file if output_file is not None else self.output_file,
+            delimiter=",",
+            quotechar='"',
+            quoting=csv.QUOTE_MINIMAL,
+        )
+
+    def walk(
+        self,
+        node: dict,
+        parent_id: str,
+        depth: int = 0,
+        numbers: str = "1",
+        make_id: Optional[Callable[[dict], str]] = None,
+    ) -> Iterator[Visit]:
+        """
+        Walks the Mind Meister hierarchy depth first using an explicit stack,
+        so there is no limit on the depth of the map. Nodes are visited in the
+        same order as they appear in the map.
+
+        Only the `subtree` is walked, the branches more than `max_depth`
+        levels below the start, or the subtree, and the branches with an
+        `exclude` title are never visited. See `include_branches` for the
+        `include` titles.
+
+        :param node: The node to start walking from, this is a dictionary.
+        :param parent_id: The id of the parent of the start node.
+        :param depth: The depth of the start node in the hierarchy.
+        :param numbers: The string of numbers for the start node e.g. '1.2'.
+        :param make_id: The node id function, see `id_generator`.
+        :returns: An iterator of (node, parent_id, id, depth, numbers,
+                  has_children) tuples.
+        :raises ExtractorError: If the subtree is not in the map.
+        """
+        if make_id is None:
+            make_id = self.id_generator()
+        if self.subtree is not None:
+            node, depth, numbers = self.find_subtree(node, depth, numbers)
+        visits = self.walk_nodes(node, parent_id, depth, numbers, make_id)
+        if self.include_pattern is not None:
+            visits = include_branches(visits, self.include_pattern)
+        return visits
+
+    def walk_nodes(
+        self,
+        node: dict,
+        parent_id: str,
+        depth: int,
+        numbers: str,
+        make_id: Callable[[dict], str],
+    ) -> Iterator[Visit]:
+        max_depth = sys.maxsize
+        if self.max_depth is not None:
+            max_depth = depth + self.max_depth
+        exclude = self.exclude_pattern
+        stack = [(node, parent_id, depth, numbers)]
+        pop = stack.pop
+        extend = stack.extend
+
+        while stack:
+            node, parent_id, depth, numbers = pop()
+            if exclude is not None and exclude.search(node.get("title", "")):
+                continue
+            id = make_id(node)
+            children = node.get("children")
+
+            yield node, parent_id, id, depth, numbers, bool(children)
+
+            if children and depth < max_depth:
+                depth += 1
+                extend(
+                    (child, id, depth, f"{numbers}.{count}")
+                    for count, child in zip(
+                        range(len(children), 0, -1), reversed(children)
+                    )
+                )
+
+    def is_outline_subtree(self) -> bool:
+        """
+        True if the `subtree` is an outline number e.g. '1.3.2', these always
+        start with the 1 of the root, otherwise it is a node id.
+        """
+        return re.fullmatch(r"1(\.[1-9][0-9]*)*", self.subtree) is not None
+
+    def find_subtree(
+        self, node: dict, depth: int, numbers: str
+    ) -> Tuple[dict, int, str]:
+        """
+        Finds the `subtree` below a node, by following the outline number or
+        by searching for the node id.
+
+        :returns: The subtree node, its depth and its numbers.
+        :raises ExtractorError: If the subtree is not in the map.
+        """
+        subtree = self.subtree
+        if self.is_outline_subtree():
+            if subtree == numbers or subtree.startswith(numbers + "."):
+                path = subtree[len(numbers) :].split(".")[1:]
+                for count in path:
+                    children = node.get("children") or []
+                    if int(count) > len(children):
+                        break
+                    node = children[int(count) - 1]
+                    depth += 1
+                else:
+                    return node, depth, subtree
+        else:
+            stack = [(node, depth, numbers)]
+            while stack:
+                node, depth, numbers = stack.pop()
+                if str(node.get("id")) == subtree:
+                    return node, depth, numbers
+                children = node.get("children") or []
+                stack.extend(
+                    (child, depth + 1, f"{numbers}.{count}")
+                    for count, child in reversed(list(enumerate(children, 1)))
+                )
+        raise ExtractorError(f"There is no node '{subtree}' in the map.")
+
+    def stream_walk(
+        self,
+        map_file: IO[str],
+        parent_id: str,
+        chunk_size: int = 1 << 16,
+        make_id: Optional[Callable[[dict], str]] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> Iterator[Visit]:
+        """
+        Walks the Mind Meister hierarchy while the map.json text is read, in
+        the same order as `walk`. Only the 'title' and 'id' fields of a node,
+        and the fields of the `columns`, are decoded. All other fields are
+        skipped, so memory use depends on the depth of the map and not on
+        the size of the file.
+
+        A node is visited as soon as its 'children' are known to be empty or
+        not, this requires the 'title' and the fields of the `columns` to
+        come before the 'children'. MindMeister writes most fields there,
+        but e.g. 'boundary', 'video' and 'property' come after them and
+        can not be streamed.
+
+        Pruned branches, see `walk`, are skipped over without decoding them
+        and reading stops at the end of the `subtree`.
+
+        :param map_file: The map.json text stream.
+        :param parent_id: The id of the parent of the root node.
+        :param chunk_size: The number of characters to read at a time.
+        :param make_id: The node id function, see `id_generator`.
+        :param fields: The node fields to decode, those of the `columns` by
+                       default.
+        :returns: An iterator of (node, parent_id, id, depth, numbers,
+                  has_children) tuples.
+        :raises ExtractorError: If the map is not valid.
+        """
+        if make_id is None:
+            make_id = self.id_generator()
+        if fields is None:
+            fields = stream_fields(self.columns)
+            if self.attachments_dir is not None:
+                fields += ["attachments", "image"]
+        visits = self.stream_nodes(
+            map_file, parent_id, chunk_size, make_id, set(fields)
+        )
+        if self.include_pattern is not None:
+            visits = include_branches(visits, self.include_pattern)
+        return visits
+
+    def stream_nodes(
+        self,
+        map_file: IO[str],
+        parent_id: str,
+        chunk_size: int,
+        make_id: Callable[[dict], str],
+        fields: set,
+    ) -> Iterator[Visit]:
+        tokens = JsonTokenizer(map_file, chunk_size)
+        exclude = self.exclude_pattern
+        subtree = self.subtree
+        outline = None
+        if subtree is not None and self.is_outline_subtree():
+            outline = subtree
+        node_id = subtree if outline is None else None
+        # The depth below which branches are skipped, this is relative to
+        # the subtree which is only known up front for an outline number.
+        levels = sys.maxsize if self.max_depth is None else self.max_depth
+        max_depth = levels + (0 if outline is None else outline.count("."))
+
+        tokens.expect("{")
+        while True:
+            if tokens.peek() != '"':
+                raise ExtractorError(
+                    "Incorrect data format, is this a correct .mind file?"
+                )
+            key = tokens.read_string()
+            tokens.expect(":")
+            if key == "root":
+                break
+            tokens.skip_value()
+            tokens.accept(",")
+
+        tokens.expect("{")
+        # Frame: [node, parent_id, id, depth, numbers, visited, child count,
+        # inside], the id is given when the node is visited so it is known
+        # for the 'node' id scheme. Nodes outside the subtree are not
+        # visited and pass the parent id on to their children.
+        frame = [{}, parent_id, None, 0, "1", False, 0, subtree in (None, "1")]
+        stack = []
+
+        def enter(parent: list) -> Optional[list]:
+            """
+            Enters the next child of `parent` that can be in the subtree,
+            after the '[' or ',' before it. Other children are skipped.
+
+            :returns: The frame of the child, or None at the end of the
+                      children.
+            """
+            while True:
+                parent[6] += 1
+                numbers = f"{parent[4]}.{parent[6]}"
+                inside = parent[7] or numbers == outline
+                if (
+                    inside
+                    or outline is None
+                    or outline.startswith(numbers + ".")
+                ):
+                    tokens.expect("{")
+                    stack.append(parent)
+                    return [
+                        {},
+                        parent[2],
+                        None,
+                        parent[3] + 1,
+                        numbers,
+                        False,
+                        0,
+                        inside,
+                    ]
+                tokens.skip_value()
+                if not tokens.accept(","):
+                    tokens.expect("]")
+                    return None
+
+        while True:
+            char = tokens.peek()
+
+            if char == "}":
+                tokens.pos += 1
+                node, parent_id, _, depth, numbers, visited, _, inside = frame
+                if not visited:
+                    if node_id is not None and str(node.get("id")) == node_id:
+                        inside = True
+                    if inside and not (
+                        exclude is not None
+                        and exclude.search(node.get("title", ""))
+                    ):
+                        id = make_id(node)
+                        yield node, parent_id, id, depth, numbers, False
+                if inside and subtree is not None:
+                    if not stack or not stack[-1][7]:
+                        # The end of the subtree, the rest is not needed.
+                        return
+                if not stack:
+                    if subtree is not None:
+                        raise ExtractorError(
+                            f"There is no node '{subtree}' in the map."
+                        )
+                    return
+
+                # Back in the children array of the parent.
+                frame = stack.pop()
+                if tokens.accept(","):
+                    frame = enter(frame) or frame
+                else:
+                    tokens.expect("]")
+                continue
+
+            if char == ",":
+                tokens.pos += 1
+                continue
+
+            key = tokens.read_key()
+
+            if key == "children" and not frame[5]:
+                node, parent_id, _, depth, numbers, _, _, inside = frame
+                frame[5] = True
+                if node_id is not None and str(node.get("id")) == node_id:
+                    inside = frame[7] = True
+                    max_depth = depth + levels
+                if not inside:
+                    frame[2] = parent_id
+                elif exclude is not None and exclude.search(
+                    node.get("title", "")
+                ):
+                    tokens.skip_value()
+                    continue
+                else:
+                    id = frame[2] = make_id(node)
+
+                if not tokens.accept("["):
+                    tokens.read_value()
+                    if inside:
+                        yield node, parent_id, id, depth, numbers, False
+                elif tokens.accept("]"):
+                    if inside:
+                        yield node, parent_id, id, depth, numbers, False
+                else:
+                    if inside:
+                        yield node, parent_id, id, depth, numbers, True
+                    if inside and depth >= max_depth:
+                        tokens.skip_nested(1)
+                    else:
+                        frame = enter(frame) or frame
+            elif key in fields:
+                if frame[5]:
+                    raise ExtractorError(
+                        f"The node field '{key}' after its children is not "
+                        "supported when streaming the map."
+                    )
+                frame[0][key] = tokens.read_any()
+            else:
+                tokens.skip_value()
+
+    def write_rows(self, visits: Iterator[Visit], csv_writer):
+        """
+        Writes a csv row with the `columns`, by default the title with a
+        number prefix, for every visited node that has a title, see
+        `csv_rows`.
+
+        :param visits: The nodes visited by `walk` or `stream_walk`.
+        :param csv_writer: The csv writer to write the rows to, a plain
+                           csv.writer or a `BufferedCsvWriter`.
+        """
+        csv_writer.writerows(csv_rows(visits, columns=self.columns))
+
+    def can_split(self) -> bool:
+        """
+        True if a loaded map can be split into branches that are converted
+        in forked processes, see `write_split`. The pruning options and the
+        attachments need the whole map, and without fork the map would have
+        to be pickled for every process.
+        """
+        return (
+            self.max_depth is None
+            and self.subtree is None
+            and self.include is None
+            and self.exclude is None
+            and self.attachments_dir is None
+            and "fork" in multiprocessing.get_all_start_methods()
+        )
+
+    def split_map(
+        self, root: dict, parent_id: str, jobs: int
+    ) -> List[Union[Visit, Branch]]:
+        """
+        Splits a map into branches of about the same size, a few for every
+        process, in the order of `walk`. The nodes above the branches are
+        visited here.
+
+        :param root: The root node of the map.
+        :param parent_id: The id of the parent of the root node.
+        :param jobs: The number of processes the branches are meant for.
+        :returns: The visits of the nodes above the branches and the
+                  branches, in the order of the rows.
+        """
+        # The number of nodes in every branch, keyed by the node's id().
+        sizes: Dict[int, int] = {}
+        stack = [(root, False)]
+        while stack:
+            node, done = stack.pop()
+            children = node.get("children") or []
+            if done:
+                sizes[id(node)] = 1 + sum(
+                    sizes[id(child)] for child in children
+                )
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in children)
+
+        target = max(1, sizes[id(root)] // (jobs * 4))
+        make_id = self.id_generator()
+        pieces: List[Union[Visit, Branch]] = []
+        count = 0
+        stack = [(root, parent_id, 0, "1", ())]
+
+        while stack:
+            node, parent_id, depth, numbers, path = stack.pop()
+            children = node.get("children")
+            if not children or sizes[id(node)] <= target:
+                pieces.append(
+                    Branch(path, parent_id, depth, numbers, count + 1)
+                )
+                count += sizes[id(node)]
+                continue
+
+            count += 1
+            if self.id_scheme == "counter":
+                node_id = str(count)
+            else:
+                node_id = make_id(node)
+            pieces.append((node, parent_id, node_id, depth, numbers, True))
+            stack.extend(
+                (
+                    child,
+                    node_id,
+                    depth + 1,
+                    f"{numbers}.{index + 1}",
+                    path + (index,),
+                )
+                for index, child in reversed(list(enumerate(children)))
+            )
+
+        return pieces
+
+    def write_branch(self, root: dict, branch: Branch) -> str:
+        """
+        :returns: The csv rows of a branch of the map, with the same ids as
+                  when the whole map is walked.
+        """
+        node = root
+        for index in branch.path:
+            node = node["children"][index]
+
+        make_id: Callable[[dict], str]
+        if self.id_scheme == "counter":
+            next_id = map(str, itertools.count(branch.first_id)).__next__
+
+            def make_id(node: dict) -> str:
+                return next_id()
+
+        else:
+            make_id = self.id_generator()
+
+        output = io.StringIO()
+        visits = self.walk_nodes(
+            node, branch.parent_id, branch.depth, branch.numbers, make_id
+        )
+        self.write_rows(visits, BufferedCsvWriter(output))
+        return output.getvalue()
+
+    def write_split(
+        self, root: dict, csv_writer: BufferedCsvWriter, jobs: int
+    ):
+        """
+        Converts the branches of a loaded map, see `split_map`, in a pool of
+        `jobs` forked processes and writes their rows in the original order.
+        The output is the same as `write_rows`, byte for byte when the id
+        scheme is deterministic.
+
+        :param root: The root node of the map.
+        :param csv_writer: The writer to write the rows to.
+        :param jobs: The number of processes to use.
+        """
+        pieces = self.split_map(root, self.root_parent_id(), jobs)
+        branches = [piece for piece in pieces if isinstance(piece, Branch)]
+        # Forked workers inherit the arguments of their initializer instead
+        # of unpickling the map, and every call has its own pool, so maps
+        # split from many threads at a time do not share any state.
+        with concurrent.futures.ProcessPoolExecutor(
+            jobs,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_split_worker,
+            initargs=(self, root),
+        ) as executor:
+            texts = executor.map(_write_branch, branches)
+            for is_branch, group in itertools.groupby(
+                pieces, lambda piece: isinstance(piece, Branch)
+            ):
+                if is_branch:
+                    for _ in group:
+                        csv_writer.write(next(texts))
+                else:
+                    csv_writer.writerows(csv_rows(group, columns=self.columns))
+        csv_writer.flush()
+
+    def parse(self, parent_id: str, depth: int, numbers: str, node: dict):
+        """
+        Walks the Mind Meister hierarchy and outputs the title of every node
+        with a number prefix.
+
+        :param parent_id: The id of the parent of the node.
+        :param depth: The current depth in the hierarchy.
+        :param numbers: The string of numbers for the current node
+                        e.g. '1.2.4.5'.
+        :param node: The node element currently processed, this is a dictionary.
+        """
+        self.write_rows(
+            self.walk(node, parent_id, depth, numbers), self.csv_writer
+        )
+
+    @contextmanager
+    def open_map(self, file_path: MapSource) -> Iterator[IO[bytes]]:
+        """
+        Opens the map.json member of the .mind archive for reading, nothing is
+        extracted to disk.
+
+        :param file_path: The path, bytes or binary file of the .mind file,
+                          or the path of an extracted map.json file.
+        :returns: The binary map.json file.
+        :raises ExtractorError: If the archive does not contain a map.
+        """
+        if isinstance(file_path, (bytes, bytearray, memoryview)):
+            file_path = io.BytesIO(file_path)
+        elif isinstance(file_path, str) and file_path.endswith(".json"):
+            with open(file_path, "rb") as map_file:
+                yield map_file
+            return
+
+        try:
+            zip_file = zipfile.ZipFile(file_path)
+        except zipfile.BadZipFile:
+            raise ExtractorError(
+                "Could not open the archive, is this a correct .mind file?"
+            )
+
+        with zip_file:
+            try:
+                map_file = zip_file.open(MAP_FILE_NAME)
+            except KeyError:
+                raise ExtractorError(
+                    f"Could not find {MAP_FILE_NAME} in the archive, is this "
+                    "a correct .mind file?"
+                )
+            with map_file:
+                yield map_file
+
+    @contextmanager
+    def read_map(self, file_path: MapSource) -> Iterator[MapBuffer]:
+        """
+        Gives the bytes of the map.json file. An extracted map.json file, or
+        a map.json that is stored uncompressed in a .mind archive on disk, is
+        memory mapped instead of read so the bytes are not copied. The view
+        is only valid inside the with block.
+
+        :param file_path: The path, bytes or binary file of the .mind file,
+                          or the path of an extracted map.json file.
+        :returns: The bytes, or a memoryview of the mapped file.
+        :raises ExtractorError: If the archive does not contain a map.
+        """
+        span = None
+        if isinstance(file_path, str):
+            span = self.stored_map_span(file_path)
+        if span is None:
+            with self.open_map(file_path) as map_file:
+                yield map_file.read()
+            return
+
+        with open(file_path, "rb") as file:
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(mapped)[span[0] : span[1]]
+        try:
+            yield view
+        finally:
+            view.release()
+            mapped.close()
+
+    @staticmethod
+    def stored_map_span(file_path: str) -> Optional[Tuple[int, int]]:
+        """
+        Finds the map.json bytes of a file that can be memory mapped, an
+        extracted map.json file or an uncompressed map.json in an archive.
+
+        :returns: The start and end offset in the file, or None if the map
+                  has to be read instead.
+        """
+        try:
+            if file_path.endswith(".json"):
+                size = os.path.getsize(file_path)
+                return (0, size) if size else None
+            with zipfile.ZipFile(file_path) as zip_file:
+                info = zip_file.getinfo(MAP_FILE_NAME)
+                if (
+                    info.compress_type != zipfile.ZIP_STORED
+                    or info.flag_bits & 0x1
+                    or not info.file_size
+                ):
+                    return None
+                with open(file_path, "rb") as file:
+                    file.seek(info.header_offset)
+                    header = file.read(30)
+        except (OSError, KeyError, zipfile.BadZipFile):
+            # Let open_map report the error.
+            return None
+        if len(header) < 30 or header[:4] != b"PK\x03\x04":
+            return None
+        name_length, extra_length = struct.unpack("<HH", header[26:30])
+        start = info.header_offset + 30 + name_length + extra_length
+        return start, start + info.file_size
+
+    @contextmanager
+    def export_attachments(
+        self, source: MapSource
+    ) -> Iterator[AttachmentExporter]:
+        """
+        Gives an `AttachmentExporter` for the `attachments_dir` that extracts
+        the attachments it found when the with block ends without an error.
+
+        :param source: The path, bytes or binary file of the .mind file.
+        :raises ExtractorError: If the source is not an archive or the
+                                attachments exceed the limits.
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        try:
+            zip_file = zipfile.ZipFile(source)
+        except zipfile.BadZipFile:
+            raise ExtractorError(
+                "Attachments can only be exported from a .mind archive."
+            )
+        with zip_file:
+            exporter = AttachmentExporter(
+                zip_file,
+                self.attachments_dir,
+                max_bytes=self.max_attachment_bytes,
+                max_ratio=self.max_compression_ratio,
+            )
+            yield exporter
+            exporter.extract()
+
+    def load_map(self, file_path: MapSource) -> dict:
+        """
+        Reads the map.json file straight out of the .mind archive, nothing is
+        extracted to disk.
+
+        :param file_path: The path, bytes or binary file of the .mind file.
+        :returns: The decoded MindMeister map.
+        :raises ExtractorError: If the archive does not contain a valid map.
+        """
+        with self.read_map(file_path) as map_bytes:
+            return self.decode_map(map_bytes)
+
+    @staticmethod
+    def decode_map(map_bytes: MapBuffer) -> dict:
+        """
+        Decodes the bytes of a map.json file. A memoryview is decoded to text
+        straight from its buffer, without a copy of the bytes.
+
+        :raises MapTooDeepError: If the map is nested too deep to decode.
+        :raises ExtractorError: If the bytes are not valid JSON.
+        """
+        try:
+            if isinstance(map_bytes, memoryview):
+                return json.loads(str(map_bytes, "utf-8-sig"))
+            return json.loads(map_bytes)
+        except RecursionError:
+            raise MapTooDeepError(
+                "The map is nested too deep to load, convert it with --stream."
+            )
+        except ValueError:
+            raise ExtractorError(
+                "Could not load the MindMeister map file, is this a "
+                "correct .mind file?"
+            )
+
+    def unzip(self, file_path: str, dest_dir: Optional[str] = None) -> str:
+        """
+        This will unzip all the members of the given file, including images
+        and attachments, into a folder. This is only needed when the caller
+        wants the attachments, conversion reads the map with `load_map`.
+
+        :param file_path: The path of the file to extract.
+        :param dest_dir: The folder to extract to, defaults to a
+                         'mindmeister' folder in the temporary folder.
+        :returns: The path to the folder that was extracted.
+        """
+        if dest_dir is None:
+            dest_dir = os.path.join(tempfile.gettempdir(), "mindmeister")
+
+        with zipfile.ZipFile(file_path) as zip_file:
+            for member in zip_file.infolist():
+                # Path traversal defense copied from
+                # http://hg.python.org/cpython/file/tip/Lib/http/server.py#l789
+                words = member.filename.split("/")
+                path = dest_dir
+                for word in words[:-1]:
+                    drive, word = os.path.splitdrive(word)
+                    head, word = os.path.split(word)
+                    if word in (os.curdir, os.pardir, ""):
+                        continue
+                    path = os.path.join(path, word)
+                zip_file.extract(member, path)
+
+        return dest_dir
+
+    def convert(
+        self,
+        input_file_path: str,
+        output_file_path: str,
+        extract_dir: Optional[str] = None,
+        stream: bool = False,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        stats: Optional[ConversionStats] = None,
+        cache: Optional[ResultCache] = None,
+        jobs: int = 1,
+        compression_level: Optional[int] = None,
+    ):
+        """
+        Opens and parses the input file and if the data is in the correct
+        format it will produce a flat representation of the Mind Meister
+        hierarchy. File errors are logged.
+
+        :param input_file_path: The file path of the .mind file to read from.
+        :param output_file_path: The file path of the .csv file to write to,
+                                 if this is an empty string it will print the
+                                 result to stdout. A path that ends in .gz,
+                                 .bz2 or .xz is compressed.
+        :param extract_dir: If given all the archive members, including the
+                            attachments, are extracted into this folder.
+        :param stream: Read the map incrementally with `stream_walk` instead
+                       of loading it into memory first.
+        :param buffer_size: The size of the chunks written to the output.
+        :param stats: Records the phase timings and counters if given.
+        :param cache: Reuse the output of earlier conversions of the same
+                      file from this cache, this needs a deterministic id
+                      scheme when ids are printed.
+        :param jobs: The number of processes to convert the branches of the
+                     map with, see `write_csv`.
+        :param compression_level: The level of a compressed output file.
+        :raises ExtractorError: An ExtractorError is raised with the data
+                                format is incorrect.
+        """
+        try:
+            self.convert_file(
+                input_file_path,
+                output_file_path,
+                extract_dir,
+                stream,
+                buffer_size,
+                stats,
+                cache,
+                jobs,
+                compression_level,
+            )
+
+        except IOError as error:
+            logger.error(f"File error: {error}")
+
+    def convert_file(
+        self,
+        input_file_path: str,
+        output_file_path: str,
+        extract_dir: Optional[str] = None,
+        stream: bool = False,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        stats: Optional[ConversionStats] = None,
+        cache: Optional[ResultCache] = None,
+        jobs: int = 1,
+        compression_level: Optional[int] = None,
+    ):
+        """
+        The same as `convert` but file errors are raised instead of logged.
+        An existing output file is only replaced when the conversion
+        succeeds.
+
+        :raises ExtractorError: If the data format is incorrect.
+        :raises IOError: If a file could not be read or written.
+        """
+        if extract_dir:
+            self.unzip(input_file_path, extract_dir)
+
+        if output_file_path == "":
+            self.write_cached_csv(
+                input_file_path,
+                sys.stdout,
+                stream,
+                buffer_size,
+                stats,
+                cache,
+                jobs,
+            )
+            sys.stdout.flush()
+            return
+
+        with replace_output(
+            output_file_path, compression_level
+        ) as output_file:
+            self.write_cached_csv(
+                input_file_path,
+                output_file,
+                stream,
+                buffer_size,
+                stats,
+                cache,
+                jobs,
+            )
+
+    def write_cached_csv(
+        self,
+        input_file_path: str,
+        output_file: IO[str],
+        stream: bool = False,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        stats: Optional[ConversionStats] = None,
+        cache: Optional[ResultCache] = None,
+        jobs: int = 1,
+    ):
+        """
+        The same as `write_csv`, but a cached result is copied to the output
+        when the file was converted with the same options before.
+        """
+        if (
+            cache is None
+            or not self.is_deterministic
+            or self.attachments_dir is not None
+        ):
+            if cache is not None and self.attachments_dir is None:
+                logger.debug(
+                    "Not caching the output of random ids, use a "
+                    "deterministic id scheme."
+                )
+            self.write_csv(
+                input_file_path, output_file, stream, buffer_size, stats, jobs
+            )
+            return
+
+        key = cache.key(input_file_path, self.output_options())
+        cached_file = cache.open(key)
+
+        if cached_file is None:
+            with cache.put(key) as cache_file:
+                self.write_csv(
+                    input_file_path,
+                    cache_file,
+                    stream,
+                    buffer_size,
+                    stats,
+                    jobs,
+                )
+            cached_file = cache.open(key)
+
+        if cached_file is None:
+            # Evicted straight away, the cache is smaller than the output.
+            # The stats are of the conversion that is written to the output.
+            if stats is not None:
+                stats.reset()
+            self.write_csv(
+                input_file_path, output_file, stream, buffer_size, stats, jobs
+            )
+            return
+
+        with cached_file:
+            shutil.copyfileobj(cached_file, output_file, buffer_size)
+
+    def write_csv(
+        self,
+        source: MapSource,
+        output_file: IO[str],
+        stream: bool = False,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        stats: Optional[ConversionStats] = None,
+        jobs: int = 1,
+    ):
+        """
+        Converts a .mind file and writes the csv rows to a text stream. This
+        does not use any state on the extractor or the file system, so one
+        extractor can convert many maps at the same time from many threads.
+
+        :param source: The path, bytes or binary file of the .mind file.
+        :param output_file: The text stream to write the csv rows to.
+        :param stream: Read the map incrementally with `stream_walk` instead
+                       of loading it into memory first. A map that is
+                       nested too deep to load is always streamed.
+        :param buffer_size: The size of the chunks written to the output.
+        :param stats: Records the phase timings and counters if given, one is
+                      created for the `on_stats` callback otherwise.
+        :param jobs: Convert the branches of a loaded map in this many
+                     processes, see `write_split`. The map is converted in
+                     this process when streaming, with stats or when
+                     `can_split` is False.
+        :raises ExtractorError: If the data format is incorrect.
+        """
+        if stats is None and self.on_stats is not None:
+            stats = ConversionStats()
+        split = not stream and jobs > 1 and stats is None and self.can_split()
+        measure = stats.phase if stats is not None else _no_phase
+        csv_writer = BufferedCsvWriter(output_file, buffer_size, stats=stats)
+
+        with ExitStack() as exit_stack:
+            if not stream:
+                with measure("read"):
+                    map_bytes = exit_stack.enter_context(self.read_map(source))
+                try:
+                    with measure("decode"):
+                        data = self.decode_map(map_bytes)
+                except MapTooDeepError:
+                    logger.debug("The map is too deep to load, streaming it.")
+                    stream, split = True, False
+                else:
+                    if stats is not None:
+                        stats.bytes_read = len(map_bytes)
+                    if "root" not in data:
+                        raise ExtractorError(
+                            "Incorrect data format, is this a correct .mind "
+                            "file?"
+                        )
+                    root = data["root"]
+                    visits = self.walk(root, self.root_parent_id())
+                del map_bytes
+
+            if stream:
+                map_file = exit_stack.enter_context(self.open_map(source))
+                text_file = io.TextIOWrapper(map_file, encoding="utf-8")
+                visits = self.stream_walk(text_file, self.root_parent_id())
+
+            if self.attachments_dir is not None:
+                attachments = exit_stack.enter_context(
+                    self.export_attachments(source)
+                )
+                visits = attachments.attach(visits)
+            if stats is not None:
+                visits = stats.count(visits)
+
+            try:
+                with measure("parse"):
+                    if split:
+                        self.write_split(root, csv_writer, jobs)
+                    else:
+                        self.write_rows(visits, csv_writer)
+            except ValueError:
+                raise ExtractorError(
+                    "Could not load the MindMeister map file, is this a "
+                    "correct .mind file?"
+                )
+
+            if stream and stats is not None:
+                stats.bytes_read = _tell(map_file)
+
+        if stats is not None:
+            # The parse phase includes the time spent writing.
+            stats.phases["parse"] -= stats.phases.get("write", 0.0)
+            stats.finish()
+            if self.on_stats is not None:
+                self.on_stats(stats)
+
+    @contextmanager
+    def visit_map(
+        self,
+        source: MapSource,
+        stream: bool = False,
+        make_id: Optional[Callable[[dict], str]] = None,
+        fields: Optional[Iterable[str]] = None,
+    ) -> Iterator[Iterator[Visit]]:
+        """
+        Opens a .mind file and gives the nodes visited by `walk`, or by
+        `stream_walk` when streaming or when the map is too deep to load,
+        from the root down.
+
+        :param source: The path, bytes or binary file of the .mind file.
+        :param stream: Read the map incrementally with `stream_walk`.
+        :param make_id: The node id function, see `id_generator`.
+        :param fields: The node fields to decode when streaming.
+        :raises ExtractorError: If the map is not valid.
+        """
+        if not stream:
+            try:
+                data = self.load_map(source)
+            except MapTooDeepError:
+                logger.debug("The map is too deep to load, streaming it.")
+            else:
+                if "root" not in data:
+                    raise ExtractorError(
+                        "Incorrect data format, is this a correct .mind file?"
+                    )
+                yield self.walk(
+                    data["root"], self.root_parent_id(), make_id=make_id
+                )
+                return
+
+        with self.open_map(source) as map_file:
+            text_file = io.TextIOWrapper(map_file, encoding="utf-8")
+            try:
+                yield self.stream_walk(
+                    text_file,
+                    self.root_parent_id(),
+                    make_id=make_id,
+                    fields=fields,
+                )
+            except ValueError:
+                raise ExtractorError(
+                    "Could not load the MindMeister map file, is this a "
+                    "correct .mind file?"
+                )
+
+    def load_tree(self, source: MapSource, stream: bool = False) -> MapTree:
+        """
+        Loads a map into a compact `MapTree` to export and query many times.
+
+        :param source: The path, bytes or binary file of the .mind file.
+        :param stream: Read the map incrementally with `stream_walk`, so the
+                       map is never held in memory as dictionaries.
+        :raises ExtractorError: If a `subtree`, `include` or `exclude` is
+                                set, the tree numbers its nodes from the
+                                root so it needs the whole map. Use the
+                                `start` of `write_tree` for a subtree.
+        """
+        if (self.subtree, self.include, self.exclude) != (None, None, None):
+            raise ExtractorError(
+                "A map tree can not be loaded with a subtree, include or "
+                "exclude pattern."
+            )
+
+        def make_id(node: dict) -> str:
+            return ""
+
+        with self.visit_map(source, stream, make_id) as visits:
+            return MapTree.from_visits(visits)
+
+    def write_sinks(
+        self,
+        source: MapSource,
+        sinks: List[Union[Sink, SqliteSink, ShardSink]],
+        stream: bool = False,
+    ):
+        """
+        Writes many outputs, each with its own format and columns, from a
+        single read and walk of the map. The visited nodes are handed to
+        every sink in batches. With an `attachments_dir` the attachments are
+        extracted too, and the attachment_files column is filled in.
+
+        :param source: The path, bytes or binary file of the .mind file.
+        :param sinks: The outputs to write.
+        :param stream: Read the map incrementally with `stream_walk`.
+        :raises ExtractorError: If the map is not valid or the attachments
+                                exceed the limits.
+        """
+        fields = stream_fields(
+            itertools.chain.from_iterable(sink.columns for sink in sinks)
+        )
+        if self.attachments_dir is not None:
+            fields += ["attachments", "image"]
+        with ExitStack() as exit_stack:
+            visits = exit_stack.enter_context(
+                self.visit_map(source, stream, fields=fields)
+            )
+            if self.attachments_dir is not None:
+                attachments = exit_stack.enter_context(
+                    self.export_attachments(source)
+                )
+                visits = attachments.attach(visits)
+            while True:
+                batch = list(itertools.islice(visits, DEFAULT_BATCH_SIZE))
+                if not batch:
+                    break
+                for sink in sinks:
+                    sink.write(batch)
+
+        for sink in sinks:
+            sink.flush()
+
+    def write_shards(
+        self,
+        source: MapSource,
+        output_file_path: str,
+        shard_by: str = "branch",
+        shard_rows: Optional[int] = None,
+        stream: bool = False,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+        compression_level: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        """
+        Converts a .mind file into many .csv files, see `ShardSink`.
+
+        :param source: The path, bytes or binary file of the .mind file.
+        :param output_file_path: The path the shard names are made from.
+        :param shard_by: 'branch' or 'rows'.
+        :param shard_rows: The most rows in a shard when sharding by rows.
+        :param stream: Read the map incrementally with `stream_walk`.
+        :param buffer_size: The size of the chunks written to a shard.
+        :param compression_level: The level of compressed shards.
+        :returns: The manifest of the shards.
+        :raises ExtractorError: If the options or the map are not valid.
+        """
+        sink = ShardSink(
+            output_file_path,
+            shard_by,
+            shard_rows,
+            self.columns,
+            buffer_size,
+            compression_level,
+        )
+        try:
+            self.write_sinks(source, [sink], stream)
+        finally:
+            sink.close()
+        return sink.manifest
+
+    def write_tree(
+        self,
+        tree: MapTree,
+        output_file: IO[str],
+        start: int = 0,
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ):
+        """
+        Writes the csv rows of a loaded tree, see `load_tree`. The tree only
+        keeps the titles, node field columns are left empty.
+
+        :param tree: The loaded map.
+        :param output_file: The text stream to write the csv rows to.
+        :param start: The node of the subtree to write, the root by default.
+        :param buffer_size: The size of the chunks written to the output.
+        """
+        parent_id = self.root_parent_id()
+        self.write_rows(
+            tree.walk(self.id_generator(), parent_id, start),
+            BufferedCsvWriter(output_file, buffer_size),
+        )
+
+    def snapshot(self, source: MapSource) -> MapSnapshot:
+        """
+        :param source: The path, bytes or binary file of the .mind file.
+        :returns: The snapshot of the map to diff later versions against.
+        """
+        data = self.load_map(source)
+        if "root" not in data:
+            raise ExtractorError(
+                "Incorrect data format, is this a correct .mind file?"
+            )
+        return MapSnapshot.from_root(data["root"])
+
+    def load_snapshot(self, file_path: str) -> MapSnapshot:
+        """
+        Loads a snapshot from a saved .json snapshot or from a .mind file.
+        """
+        if zipfile.is_zipfile(file_path):
+            return self.snapshot(file_path)
+        try:
+            return MapSnapshot.load(file_path)
+        except (ValueError, KeyError, IndexError):
+            raise ExtractorError(
+                f"{file_path} is not a .mind file or a snapshot."
+            )
+
+    def write_diff(
+        self,
+        old: MapSnapshot,
+        source: MapSource,
+        output_file: IO[str],
+        buffer_size: int = DEFAULT_BUFFER_SIZE,
+    ) -> MapSnapshot:
+        """
+        Writes a csv row for every node that was added, removed, moved,
+        re-parented or retitled since the old snapshot. The columns are the
+        change, the outline number, the node id, the parent id and the title.
+
+        :param old: The snapshot of the older version of the map.
+        :param source: The path, bytes or binary file of the new .mind file.
+        :param output_file: The text stream to write the csv rows to.
+        :param buffer_size: The size of the chunks written to the output.
+        :returns: The snapshot of the new map, to diff the next version with.
+        """
+        new = self.snapshot(source)
+        BufferedCsvWriter(output_file, buffer_size).writerows(
+            row[:4] + (clean_text(row[4]),) for row in new.diff(old)
+        )
+        return new
+
+    def convert_bytes(self, source: MapSource, stream: bool = False) -> str:
+        """
+        Converts a .mind file in memory, see `write_csv`.
+
+        :param source: The path, bytes or binary file of the .mind file.
+        :param stream: Read the map incrementally.
+        :returns: The csv text.
+        """
+        output_file = io.StringIO()
+        self.write_csv(source, output_file, stream)
+        return output_file.getvalue()
+
+
+def find_inputs(
+    paths: Iterable[str], output_dir: Optional[str] = None
+) -> List[Tuple[str, str]]:
+    """
+    Expands directories and glob patterns into .mind files and works out the
+    .csv file to write each one to. Files found in a directory keep their
+    relative path below the output folder. A path that exists is never
+    treated as a pattern, and a pattern that matches no files is kept so
+    its conversion fails.
+
+    :param paths: Files, directories or glob patterns.
+    :param output_dir: The folder to write the .csv files to, if this is
+                       None the .csv file is written next to the .mind file.
+    :returns: A list of (input file path, output file path) tuples.
+    """
+    jobs = []
+
+    def add(file_path: str, relative_path: str):
+        csv_name = os.path.splitext(relative_path)[0] + ".csv"
+        if output_dir is None:
+            output_path = os.path.splitext(file_path)[0] + ".csv"
+        else:
+            output_path = os.path.join(output_dir, csv_name)
+        jobs.append((file_path, output_path))
+
+    for path in paths:
+        if os.path.isdir(path):
+            pattern = os.path.join(path, "**", "*.mind")
+            for file_path in sorted(glob.glob(pattern, recursive=True)):
+                add(file_path, os.path.relpath(file_path, path))
+        elif glob.has_magic(path) and not os.path.exists(path):
+            file_paths = sorted(glob.glob(path, recursive=True))
+            for file_path in file_paths:
+                add(file_path, os.path.basename(file_path))
+            if not file_paths:
+                add(path, os.path.basename(path))
+        else:
+            add(path, os.path.basename(path))
+
+    return jobs
+
+
+_extractors: Dict[str, MindMeisterExtractor] = {}
+
+
+def get_extractor(options: dict) -> MindMeisterExtractor:
+    """
+    :returns: An extractor for the options, shared by all the jobs of this
+              process that use the same options.
+    """
+    # The repr, because options like columns can be lists.
+    key = repr(sorted(options.items()))
+    extractor = _extractors.get(key)
+    if extractor is None:
+        extractor = _extractors[key] = MindMeisterExtractor(**options)
+    return extractor
+
+
+def convert_job(
+    input_file_path: str,
+    output_file_path: str,
+    options: dict,
+    convert_options: Optional[dict] = None,
+) -> ConversionResult:
+    """
+    Converts a single file for `convert_many`, errors are returned instead of
+    raised so one bad file does not stop the batch.
+
+    :param options: The MindMeisterExtractor options.
+    :param convert_options: The keyword arguments for `convert_file`.
+    """
+    start = time.perf_counter()
+    error = None
+
+    try:
+        if not os.path.exists(input_file_path) and glob.has_magic(
+            input_file_path
+        ):
+            raise ExtractorError(f"No files match {input_file_path}")
+        output_dir = os.path.dirname(output_file_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        extractor = get_extractor(options)
+        extractor.convert_file(
+            input_file_path, output_file_path, **(convert_options or {})
+        )
+    except (ExtractorError, IOError) as exception:
+        error = str(exception)
+    except Exception as exception:  # A bug must not stop the batch either.
+        error = f"{type(exception).__name__}: {exception}"
+
+    try:
+        size = os.path.getsize(input_file_path)
+    except OSError:
+        size = 0
+
+    return ConversionResult(
+        input_file_path,
+        output_file_path,
+        error,
+        time.perf_counter() - start,
+        size,
+    )
+
+
+def _convert_job_tuple(job: Tuple[str, str, dict, dict]) -> ConversionResult:
+    return convert_job(*job)
+
+
+def convert_many(
+    paths: Iterable[str],
+    output_dir: Optional[str] = None,
+    jobs: int = 1,
+    stream: bool = False,
+    convert_options: Optional[dict] = None,
+    **options,
+) -> BatchSummary:
+    """
+    Converts many .mind files, spread over a pool of `jobs` processes.
+    Progress is logged in the order of the inputs.
+
+    :param paths: Files, directories or glob patterns, see `find_inputs`.
+    :param output_dir: The folder to write the .csv files to.
+    :param jobs: The number of processes to use.
+    :param stream: Read the maps incrementally.
+    :param convert_options: More keyword arguments for `convert_file` e.g.
+                            buffer_size.
+    :param options: The MindMeisterExtractor options e.g. print_numbers.
+    :returns: A summary of the successes and failures.
+    """
+    inputs = find_inputs(paths, output_dir)
+    convert_options = dict({"stream": stream}, **(convert_options or {}))
+    work = [
+        (input_path, output_path, options, convert_options)
+        for input_path, output_path in inputs
+    ]
+    summary = BatchSummary()
+    start = time.perf_counter()
+
+    if jobs > 1 and len(work) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        chunk_size = max(1, len(work) // (jobs * 8))
+        results = executor.map(_convert_job_tuple, work, chunksize=chunk_size)
+    else:
+        executor = None
+        results = map(_convert_job_tuple, work)
+
+    try:
+        for count, result in enumerate(results, 1):
+            summary.results.append(result)
+            if result.error is None:
+                logger.info(
+                    f"[{count}/{len(work)}] {result.input_file_path} -> "
+                    f"{result.output_file_path} ({result.seconds:.2f}s)"
+                )
+            else:
+                logger.error(
+                    f"[{count}/{len(work)}] {result.input_file_path}: "
+                    f"{result.error}"
+                )
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    summary.seconds = time.perf_counter() - start
+    logger.info(str(summary))
+    return summary
+
+
+# The NDJSON job keys that override the extractor options, and the types
+# their values can have.
+JOB_OPTIONS = {
+    "numbers": ("print_numbers", (bool,)),
+    "ids": ("print_ids", (bool,)),
+    "leaf": ("print_leaf_nodes", (bool,)),
+    "id_scheme": ("id_scheme", (str,)),
+    "max_depth": ("max_depth", (int, type(None))),
+    "subtree": ("subtree", (str, type(None))),
+    "include": ("include", (str, type(None))),
+    "exclude": ("exclude", (str, type(None))),
+}
+
+
+def check_job_value(line: str, key: str, value: Any, types: Tuple):
+    """
+    :raises ExtractorError: If the value of a job key is not one of `types`.
+    """
+    # bool is an int, but true is not a depth.
+    if not isinstance(value, types) or (
+        isinstance(value, bool) and bool not in types
+    ):
+        raise ExtractorError(f"Incorrect value for '{key}': {line}")
+
+
+def parse_job(
+    line: str,
+    options: dict,
+    convert_options: dict,
+    output_dir: Optional[str] = None,
+) -> Tuple[str, str, dict, dict]:
+    """
+    Parses a job line for `run_worker`. A line is either a .mind file path,
+    an input and output path separated by a tab, or a JSON object like
+    {"input": "a.mind", "output": "a.csv", "numbers": true, "stream": true}.
+
+    :param options: The default MindMeisterExtractor options.
+    :param convert_options: The default keyword arguments for `convert_file`.
+    :param output_dir: The folder to write the .csv file to when the job has
+                       no output path.
+    :returns: The arguments for `convert_job`.
+    :raises ExtractorError: If the line is not a job.
+    """
+    line = line.strip()
+    if line.startswith("{"):
+        try:
+            job = json.loads(line)
+            input_file_path = job.pop("input")
+        except (ValueError, KeyError):
+            raise ExtractorError(f"Incorrect job: {line}")
+        output_file_path = job.pop("output", None)
+        check_job_value(line, "input", input_file_path, (str,))
+        check_job_value(line, "output", output_file_path, (str, type(None)))
+        options = dict(options)
+        convert_options = dict(convert_options)
+        for key, value in job.items():
+            if key == "columns":
+                check_job_value(line, key, value, (str, list))
+                if isinstance(value, str):
+                    value = parse_columns(value)
+                for column in value:
+                    check_job_value(line, key, column, (str,))
+                    check_column(column)
+                options["columns"] = tuple(value)
+            elif key in JOB_OPTIONS:
+                name, types = JOB_OPTIONS[key]
+                check_job_value(line, key, value, types)
+                options[name] = value
+            elif key == "stream":
+                check_job_value(line, key, value, (bool,))
+                convert_options["stream"] = value
+            else:
+                raise ExtractorError(f"Unknown job option '{key}': {line}")
+        if options.get("id_scheme", "uuid") not in ID_SCHEMES:
+            raise ExtractorError(f"Unknown id scheme: {line}")
+    else:
+        input_file_path, _, output_file_path = line.partition("\t")
+
+    if not input_file_path:
+        raise ExtractorError(f"Incorrect job: {line}")
+    if not output_file_path:
+        # Not `find_inputs`, a job is always a single file and never a
+        # pattern.
+        output_file_path = os.path.splitext(input_file_path)[0] + ".csv"
+        if output_dir is not None:
+            output_file_path = os.path.join(
+                output_dir, os.path.basename(output_file_path)
+            )
+
+    return input_file_path, output_file_path, options, convert_options
+
+
+def run_worker(
+    lines: Iterable[str],
+    status_file: IO[str],
+    output_dir: Optional[str] = None,
+    jobs: int = 1,
+    convert_options: Optional[dict] = None,
+    **options,
+) -> BatchSummary:
+    """
+    Converts the jobs read from `lines`, see `parse_job`, as they arrive and
+    writes a JSON status line for each one to `status_file`, in the order
+    of the jobs. This keeps one process, or a pool of `jobs` processes, warm
+    for a stream of files so the interpreter start up is only paid once.
+
+    :param lines: The job lines, e.g. sys.stdin.
+    :param status_file: The file to write the status lines to.
+    :param output_dir: The folder to write the .csv files to.
+    :param jobs: The number of processes to use.
+    :param convert_options: More keyword arguments for `convert_file`.
+    :param options: The MindMeisterExtractor options e.g. print_numbers.
+    :returns: A summary of the successes and failures.
+    """
+    convert_options = dict({"stream": False}, **(convert_options or {}))
+    summary = BatchSummary()
+    start = time.perf_counter()
+
+    def report(result: ConversionResult):
+        summary.results.append(result)
+        status = {
+            "input": result.input_file_path,
+            "output": result.output_file_path,
+            "status": "ok" if result.error is None else "error",
+            "seconds": round(result.seconds, 6),
+        }
+        if result.error is not None:
+            status["error"] = result.error
+            logger.error(f"{result.input_file_path}: {result.error}")
+        status_file.write(json.dumps(status) + "\n")
+        status_file.flush()
+
+    def submit(
+        line: str,
+    ) -> Union[ConversionResult, "concurrent.futures.Future"]:
+        try:
+            job = parse_job(line, options, convert_options, output_dir)
+        except ExtractorError as error:
+            return ConversionResult(line.strip(), "", str(error), 0.0, 0)
+        except Exception as error:  # pragma: no cover - a last resort
+            return ConversionResult(
+                line.strip(), "", f"{type(error).__name__}: {error}", 0.0, 0
+            )
+        if executor is None:
+            return convert_job(*job)
+        return executor.submit(convert_job, *job)
+
+    executor = (
+        concurrent.futures.ProcessPoolExecutor(jobs) if jobs > 1 else None
+    )
+    # The lines are read on a thread, so a finished job is reported straight
+    # away and not when the next line arrives. The lines, the end of the
+    # input (None) and finished jobs (done) all wake up the loop below.
+    events: "queue.Queue[Any]" = queue.Queue()
+    done = object()
+
+    def read_lines():
+        try:
+            for line in lines:
+                events.put(line)
+        finally:
+            events.put(None)
+
+    threading.Thread(target=read_lines, name="read jobs", daemon=True).start()
+
+    # Keep a few jobs per process running, and report them in order.
+    pending: List = []
+    waiting: List[str] = []
+    end = False
+    try:
+        while not end or waiting or pending:
+            event = events.get()
+            if event is None:
+                end = True
+            elif event is not done and event.strip():
+                waiting.append(event)
+            while True:
+                while pending and (
+                    isinstance(pending[0], ConversionResult)
+                    or pending[0].done()
+                ):
+                    job = pending.pop(0)
+                    report(job if isinstance(job, tuple) else job.result())
+                if not waiting or len(pending) >= jobs * 4:
+                    break
+                job = submit(waiting.pop(0))
+                if not isinstance(job, ConversionResult):
+                    job.add_done_callback(lambda _: events.put(done))
+                pending.append(job)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    summary.seconds = time.perf_counter() - start
+    logger.info(str(summary))
+    return summary
+
+
+class FolderWatcher:
+    """
+    Keeps the .csv files of the .mind files in a folder up to date. The
+    folder is polled, so this works on network shares too, and a new or
+    modified file is converted once its size and modification time did not
+    change for `settle` seconds, so a file that is still being written is
+    not converted half way. A file whose content hash did not change since
+    it was last converted, e.g. one that was only touched, is skipped.
+
+    At most `jobs` conversions run at a time, on a pool of processes when
+    `jobs` is more than 1, and at most 4 per process are queued. The other
+    changed files wait for a later poll.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        output_dir: Optional[str] = None,
+        options: Optional[dict] = None,
+        convert_options: Optional[dict] = None,
+        jobs: int = 1,
+        interval: float = DEFAULT_POLL_INTERVAL,
+        settle: float = DEFAULT_SETTLE_SECONDS,
+    ):
+        """
+        :param directory: The folder to watch, including its subfolders.
+        :param output_dir: The folder to write the .csv files to, see
+                           `find_inputs`.
+        :param options: The MindMeisterExtractor options e.g. print_numbers.
+        :param convert_options: More keyword arguments for `convert_file`.
+        :param jobs: The number of conversions to run at a time.
+        :param interval: The seconds between two polls.
+        :param settle: The seconds a file must stay the same before it is
+                       converted.
+        """
+        self.directory = directory
+        self.output_dir = output_dir
+        self.options = dict(
+            {
+                "print_numbers": False,
+                "print_ids": False,
+                "print_leaf_nodes": False,
+            },
+            **(options or {}),
+        )
+        self.convert_options = convert_options or {}
+        self.jobs = jobs
+        self.interval = interval
+        self.settle = settle
+        self.executor: Optional[concurrent.futures.Executor] = None
+        # The (mtime, size) of every file and when it was first seen so.
+        self.seen: Dict[str, Tuple[Tuple[int, int], float]] = {}
+        # The (mtime, size) and sha256 of every converted file.
+        self.converted: Dict[str, Tuple[Tuple[int, int], str]] = {}
+        # The running conversions and when their file changed.
+        self.running: Dict[str, Tuple["concurrent.futures.Future", float]] = {}
+        self.metrics: Dict[str, float] = {
+            "polls": 0,
+            "converted": 0,
+            "failed": 0,
+            "unchanged": 0,
+            "queued": 0,
+            "running": 0,
+            "max_queued": 0,
+            "latency_seconds": 0.0,
+            "max_latency_seconds": 0.0,
+        }
+
+    def __enter__(self) -> "FolderWatcher":
+        if self.jobs > 1:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.jobs)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def poll(self, now: Optional[float] = None) -> List[ConversionResult]:
+        """
+        Looks for changed files once, starts the conversions of the settled
+        ones and collects the finished conversions.
+
+        :param now: The time of the poll, time.monotonic() by default.
+        :returns: The conversions that finished during this poll.
+        """
+        if now is None:
+            now = time.monotonic()
+        self.metrics["polls"] += 1
+
+        ready = []
+        found = find_inputs([self.directory], self.output_dir)
+        for input_path, output_path in found:
+            try:
+                stat = os.stat(input_path)
+            except OSError:
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size)
+            seen = self.seen.get(input_path)
+            if seen is None or seen[0] != signature:
+                self.seen[input_path] = (signature, now)
+                continue
+            converted = self.converted.get(input_path)
+            if (
+                now - seen[1] >= self.settle
+                and input_path not in self.running
+                and (converted is None or converted[0] != signature)
+            ):
+                ready.append((input_path, output_path, signature, seen[1]))
+
+        # Forget the files that were removed.
+        inputs = {input_path for input_path, _ in found}
+        for input_path in list(self.seen):
+            if input_path not in inputs:
+                del self.seen[input_path]
+                self.converted.pop(input_path, None)
+
+        limit = self.jobs * 4
+        for index, (input_path, output_path, signature, changed) in enumerate(
+            ready
+        ):
+            if len(self.running) >= limit:
+                self.metrics["queued"] = len(ready) - index
+                break
+            try:
+                digest = file_digest(input_path).hexdigest()
+            except OSError:
+                continue
+            converted = self.converted.get(input_path)
+            self.converted[input_path] = (signature, digest)
+            if converted is not None and converted[1] == digest:
+                self.metrics["unchanged"] += 1
+                logger.debug(f"Skipped {input_path}, it did not change")
+                continue
+            self.running[input_path] = (
+                self.submit(input_path, output_path),
+                changed,
+            )
+        else:
+            self.metrics["queued"] = 0
+
+        self.metrics["max_queued"] = max(
+            self.metrics["max_queued"], self.metrics["queued"]
+        )
+        self.metrics["running"] = len(self.running)
+        return self.collect(now)
+
+    def submit(
+        self, input_path: str, output_path: str
+    ) -> "concurrent.futures.Future":
+        job = (input_path, output_path, self.options, self.convert_options)
+        if self.executor is not None:
+            return self.executor.submit(convert_job, *job)
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        future.set_result(convert_job(*job))
+        return future
+
+    def collect(self, now: float) -> List[ConversionResult]:
+        results = []
+        for input_path, (future, changed) in list(self.running.items()):
+            if not future.done():
+                continue
+            del self.running[input_path]
+            result = future.result()
+            results.append(result)
+            latency = now - changed
+            self.metrics["latency_seconds"] = latency
+            self.metrics["max_latency_seconds"] = max(
+                self.metrics["max_latency_seconds"], latency
+            )
+            if result.error is None:
+                self.metrics["converted"] += 1
+                logger.info(
+                    f"Converted {input_path} in {result.seconds:.2f}s, "
+                    f"{latency:.2f}s after it changed, "
+                    f"{len(self.running)} running and "
+                    f"{self.metrics['queued']} queued"
+                )
+            else:
+                self.metrics["failed"] += 1
+                logger.error(f"{input_path}: {result.error}")
+                # Try again on a later poll, the error may not last.
+                self.converted.pop(input_path, None)
+        self.metrics["running"] = len(self.running)
+        return results
+
+    def run(self, polls: Optional[int] = None):
+        """
+        Polls the folder every `interval` seconds, forever or `polls` times.
+        """
+        with self:
+            for _ in itertools.count() if polls is None else range(polls):
+                self.poll()
+                time.sleep(self.interval)
+
+
+def convert_upload(source: bytes, options: dict, stream: bool) -> bytes:
+    """
+    Converts an uploaded .mind file for the `ConversionServer` workers. The
+    csv is encoded by the worker, so the server only holds the bytes.
+    """
+    extractor = MindMeisterExtractor(**options)
+    return extractor.convert_bytes(source, stream).encode()
+
+
+class HttpError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ConversionServer:
+    """
+    A long running HTTP server that converts uploaded .mind files. The
+    conversions run on a warm pool of worker processes, or threads, so a
+    request does not pay for starting the interpreter.
+
+    POST /convert?numbers=1&ids=1&leaf=1&id_scheme=node&stream=1 with the
+    .mind file as the body returns the csv, columns=numbers,title,note
+    picks the columns like --columns. GET /metrics returns the
+    request and concurrency counters as JSON and GET /health returns 'ok'.
+
+    At most `workers` conversions run at a time and at most `max_pending`
+    more wait for a worker, requests beyond that are turned away with a 503
+    before their upload is read, so the server does not queue more work, or
+    hold more uploads, than it can handle. The csv is sent once it is
+    complete, with a Content-Length, and not streamed while converting.
+    """
+
+    STATUS = {
+        200: "OK",
+        400: "Bad Request",
+        404: "Not Found",
+        405: "Method Not Allowed",
+        408: "Request Timeout",
+        411: "Length Required",
+        413: "Payload Too Large",
+        422: "Unprocessable Entity",
+        500: "Internal Server Error",
+        503: "Service Unavailable",
+    }
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 8080,
+        workers: Optional[int] = None,
+        threads: bool = False,
+        max_upload: int = DEFAULT_MAX_UPLOAD,
+        max_pending: Optional[int] = None,
+        timeout: float = 30.0,
+    ):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        self.max_upload = max_upload
+        self.max_pending = (
+            max_pending if max_pending is not None else self.workers * 4
+        )
+        self.timeout = timeout
+        self.executor: Optional[concurrent.futures.Executor] = None
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.slots: Optional[asyncio.Semaphore] = None
+        self.metrics: Dict[str, float] = {
+            "requests": 0,
+            "converted": 0,
+            "failed": 0,
+            "rejected": 0,
+            "admitted": 0,
+            "active": 0,
+            "pending": 0,
+            "max_active": 0,
+            "max_pending": 0,
+            "bytes_in": 0,
+            "bytes_out": 0,
+            "convert_seconds": 0.0,
+        }
+
+    async def start(self):
+        if self.threads:
+            self.executor = concurrent.futures.ThreadPoolExecutor(self.workers)
+        else:
+            self.executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers
+            )
+            # Start the workers and their imports before the first request.
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(
+                *(
+                    loop.run_in_executor(self.executor, int)
+                    for _ in range(self.workers)
+                )
+            )
+        self.slots = asyncio.Semaphore(self.workers)
+        self.server = await asyncio.start_server(
+            self.handle, self.host, self.port
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(
+            f"Serving on http://{self.host}:{self.port} with {self.workers} "
+            f"{'threads' if self.threads else 'processes'}"
+        )
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    async def serve_forever(self):
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        self.metrics["requests"] += 1
+        try:
+            status, content_type, body = await self.respond(reader)
+        except HttpError as error:
+            if error.status in (413, 503):
+                self.metrics["rejected"] += 1
+            status, content_type = error.status, "text/plain"
+            body = f"{error}\n".encode()
+        except Exception as error:  # pragma: no cover - a last resort
+            logger.error(f"Request failed: {error}")
+            status, content_type, body = 500, "text/plain", b"Error\n"
+
+        try:
+            writer.write(
+                (
+                    f"HTTP/1.1 {status} {self.STATUS[status]}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n"
+                ).encode("latin-1")
+            )
+            # Write in chunks and wait for slow clients to catch up, so a
+            # large csv is never all queued in the transport at once.
+            view = memoryview(body)
+            for start in range(0, len(view), DEFAULT_BUFFER_SIZE):
+                writer.write(view[start : start + DEFAULT_BUFFER_SIZE])
+                await writer.drain()
+            await writer.drain()
+            self.metrics["bytes_out"] += len(body)
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def respond(
+        self, reader: asyncio.StreamReader
+    ) -> Tuple[int, str, bytes]:
+        """
+        Reads a request and works out the response. Reading the request has
+        to finish within the `timeout`, the conversion is not limited.
+
+        :returns: The status, content type and body of the response.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+
+        async def read(awaitable: Awaitable[bytes]) -> bytes:
+            try:
+                return await asyncio.wait_for(
+                    awaitable, max(0.0, deadline - loop.time())
+                )
+            except asyncio.TimeoutError:
+                raise HttpError(408, "The request took too long.")
+
+        try:
+            request_line = await read(reader.readline())
+            method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "Incorrect request line.")
+
+        headers = {}
+        while True:
+            line = await read(reader.readline())
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        url = urlsplit(target)
+        if url.path == "/health":
+            return 200, "text/plain", b"ok\n"
+        if url.path == "/metrics":
+            return 200, "application/json", json.dumps(self.metrics).encode()
+        if url.path != "/convert":
+            raise HttpError(404, "Use POST /convert, /metrics or /health.")
+        if method != "POST":
+            raise HttpError(405, "Upload the .mind file with POST.")
+
+        try:
+            length = int(headers["content-length"])
+        except (KeyError, ValueError):
+            raise HttpError(411, "A Content-Length header is needed.")
+        if length > self.max_upload:
+            raise HttpError(
+                413, f"The upload is larger than {self.max_upload} bytes."
+            )
+
+        query = {
+            name: values[-1] for name, values in parse_qs(url.query).items()
+        }
+        options = {
+            "print_numbers": _is_true(query.get("numbers")),
+            "print_ids": _is_true(query.get("ids")),
+            "print_leaf_nodes": _is_true(query.get("leaf")),
+            "id_scheme": query.get("id_scheme", "uuid"),
+        }
+        if options["id_scheme"] not in ID_SCHEMES:
+            raise HttpError(400, f"Use an id_scheme of {ID_SCHEMES}.")
+        if "columns" in query:
+            try:
+                options["columns"] = parse_columns(query["columns"])
+            except ExtractorError as error:
+                raise HttpError(400, str(error))
+
+        # Admitted before the upload is read, so the uploads held in memory
+        # are limited too.
+        if self.metrics["admitted"] >= self.workers + self.max_pending:
+            raise HttpError(503, "The server is busy, try again later.")
+        self.metrics["admitted"] += 1
+        try:
+            source = await read(reader.readexactly(length))
+            self.metrics["bytes_in"] += length
+            output = await self.convert(
+                source, options, _is_true(query.get("stream"))
+            )
+        finally:
+            self.metrics["admitted"] -= 1
+        return 200, "text/csv; charset=utf-8", output
+
+    async def convert(
+        self, source: bytes, options: dict, stream: bool
+    ) -> bytes:
+        """
+        Waits for a free worker and converts `source` on it. The worker is
+        only given back when the conversion is done, also when the request
+        is cancelled before that, so at most `workers` conversions run.
+        """
+        metrics = self.metrics
+        metrics["pending"] += 1
+        metrics["max_pending"] = max(
+            metrics["max_pending"], metrics["pending"]
+        )
+        try:
+            await self.slots.acquire()
+        finally:
+            metrics["pending"] -= 1
+
+        metrics["active"] += 1
+        metrics["max_active"] = max(metrics["max_active"], metrics["active"])
+        start = time.perf_counter()
+
+        def done(_: asyncio.Future):
+            metrics["active"] -= 1
+            metrics["convert_seconds"] += time.perf_counter() - start
+            self.slots.release()
+
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, convert_upload, source, options, stream
+        )
+        future.add_done_callback(done)
+        try:
+            output = await asyncio.shield(future)
+        except ExtractorError as error:
+            metrics["failed"] += 1
+            raise HttpError(422, str(error))
+        metrics["converted"] += 1
+        return output
+
+
+def _is_true(value: Optional[str]) -> bool:
+    return value is not None and value.lower() in ("1", "true", "yes", "")
+
+
+def serve_main(argv: List[str]):
+    args_parser = argparse.ArgumentParser(
+        prog="mm2csv serve",
+        description="Runs an HTTP server that converts uploaded .mind files.",
+    )
+    args_parser.add_argument("--host", type=str, default="127.0.0.1")
+    args_parser.add_argument("--port", type=int, default=8080)
+    args_parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="The number of conversions to run at a time (CPU count).",
+    )
+    args_parser.add_argument(
+        "--threads",
+        help="Convert on threads instead of processes (False).",
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--max-upload",
+        type=int,
+        default=DEFAULT_MAX_UPLOAD,
+        help=f"The largest upload in bytes ({DEFAULT_MAX_UPLOAD}).",
+    )
+    args_parser.add_argument(
+        "--max-pending",
+        type=int,
+        default=None,
+        help=(
+            "The number of conversions that may wait for a worker before "
+            "requests are turned away (4 per worker)."
+        ),
+    )
+    args = args_parser.parse_args(argv)
+
+    server = ConversionServer(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        threads=args.threads,
+        max_upload=args.max_upload,
+        max_pending=args.max_pending,
+    )
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+def index_main(argv: List[str]):
+    args_parser = argparse.ArgumentParser(
+        prog="mm2csv index",
+        description=(
+            "Adds the nodes of .mind files to a full text search index, maps "
+            "that did not change since they were indexed are skipped."
+        ),
+        fromfile_prefix_chars="@",
+    )
+    args_parser.add_argument(
+        "file",
+        nargs="+",
+        help="The .mind files, directories or glob patterns to index.",
+    )
+    args_parser.add_argument(
+        "--index",
+        type=str,
+        default=DEFAULT_INDEX_PATH,
+        help=f"The search index database ({DEFAULT_INDEX_PATH}).",
+    )
+    args_parser.add_argument(
+        "--force",
+        help="Index all the maps again, also the unchanged ones (False).",
+        action="store_true",
+    )
+    args = args_parser.parse_args(argv)
+
+    indexed = unchanged = failed = 0
+    start = time.perf_counter()
+    try:
+        with SearchIndex(args.index) as index:
+            for file_path, _ in find_inputs(args.file):
+                try:
+                    if index.add(file_path, args.force):
+                        indexed += 1
+                        logger.info(f"Indexed {file_path}")
+                    else:
+                        unchanged += 1
+                except (ExtractorError, IOError) as error:
+                    failed += 1
+                    logger.error(f"{file_path}: {error}")
+            removed = index.prune()
+    except ExtractorError as error:
+        logger.error(error)
+        sys.exit(1)
+
+    logger.info(
+        f"Indexed {indexed} maps, {unchanged} unchanged, {failed} failed and "
+        f"{removed} removed in {time.perf_counter() - start:.2f}s"
+    )
+    if failed:
+        sys.exit(1)
+
+
+def search_main(argv: List[str]):
+    args_parser = argparse.ArgumentParser(
+        prog="mm2csv search",
+        description="Searches the node titles of the indexed maps.",
+    )
+    args_parser.add_argument(
+        "query",
+        help=(
+            "The words to find, with the SQLite FTS5 syntax e.g. budget, "
+            '"budget AND 2024", bud* or "exact phrase".'
+        ),
+    )
+    args_parser.add_argument(
+        "--index",
+        type=str,
+        default=DEFAULT_INDEX_PATH,
+        help=f"The search index database ({DEFAULT_INDEX_PATH}).",
+    )
+    args_parser.add_argument(
+        "--limit", type=int, default=20, help="The most hits to show (20).",
+    )
+    args_parser.add_argument(
+        "--json",
+        help="Print every hit as a JSON line (False).",
+        action="store_true",
+    )
+    args = args_parser.parse_args(argv)
+
+    if not os.path.exists(args.index):
+        args_parser.error(f"There is no search index {args.index}.")
+    try:
+        with SearchIndex(args.index) as index:
+            hits = index.search(args.query, args.limit)
+    except ExtractorError as error:
+        logger.error(error)
+        sys.exit(1)
+
+    for hit in hits:
+        if args.json:
+            print(json.dumps(hit._asdict()))
+        else:
+            print(f"{hit.map_path}:{hit.numbers}: {' > '.join(hit.path)}")
+
+
+def watch_main(argv: List[str]):
+    args_parser = argparse.ArgumentParser(
+        prog="mm2csv watch",
+        description=(
+            "Watches a folder and converts the .mind files that are added or "
+            "changed."
+        ),
+    )
+    args_parser.add_argument(
+        "directory", help="The folder to watch, including its subfolders."
+    )
+    args_parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=None,
+        help=(
+            "The folder to save the .csv files to, defaults to the folder of "
+            "each .mind file."
+        ),
+    )
+    args_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="The number of processes to convert with (1).",
+    )
+    args_parser.add_argument(
+        "--interval",
+        type=float,
+        default=DEFAULT_POLL_INTERVAL,
+        help=f"The seconds between two polls ({DEFAULT_POLL_INTERVAL}).",
+    )
+    args_parser.add_argument(
+        "--settle",
+        type=float,
+        default=DEFAULT_SETTLE_SECONDS,
+        help=(
+            "The seconds a file must stay the same before it is converted "
+            f"({DEFAULT_SETTLE_SECONDS})."
+        ),
+    )
+    args_parser.add_argument(
+        "--numbers",
+        help="Print hierarchy numbers for each item e.g. 1.2.3 (False).",
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--ids",
+        help=(
+            "Generate parent child ids to retain hierarchy relationships "
+            "(False)."
+        ),
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--id-scheme",
+        choices=ID_SCHEMES,
+        default="uuid",
+        help="How --ids are generated (uuid).",
+    )
+    args_parser.add_argument(
+        "--leaf",
+        help="Mark leaf nodes with an 'L' (False).",
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--columns",
+        type=str,
+        default=None,
+        help="The comma separated columns to write, see mm2csv --help.",
+    )
+    args_parser.add_argument(
+        "--stream",
+        help="Read the maps incrementally (False).",
+        action="store_true",
+    )
+    args = args_parser.parse_args(argv)
+
+    if not os.path.isdir(args.directory):
+        args_parser.error(f"There is no folder {args.directory}.")
+    options: Dict[str, Any] = dict(
+        print_numbers=args.numbers,
+        print_ids=args.ids,
+        print_leaf_nodes=args.leaf,
+        id_scheme=args.id_scheme,
+    )
+    try:
+        if args.columns:
+            options["columns"] = tuple(parse_columns(args.columns))
+    except ExtractorError as error:
+        args_parser.error(str(error))
+
+    watcher = FolderWatcher(
+        args.directory,
+        args.output_dir,
+        options,
+        {"stream": args.stream},
+        jobs=args.jobs,
+        interval=args.interval,
+        settle=args.settle,
+    )
+    logger.info(f"Watching {args.directory}")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+# The subcommands, `mm2csv FILE` converts files.
+COMMANDS = {
+    "serve": serve_main,
+    "index": index_main,
+    "search": search_main,
+    "watch": watch_main,
+}
+
+
+def main():
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        return COMMANDS[sys.argv[1]](sys.argv[2:])
+
+    args_parser = argparse.ArgumentParser(
+        description=(
+            "This extracts a Mind Meister .mind file and converts it to a "
+            "flat .csv file."
+        ),
+        fromfile_prefix_chars="@",
+    )
+    args_parser.add_argument(
+        "file",
+        nargs="*",
+        help=(
+            "The .mind file to convert. More files, directories and glob "
+            "patterns can be given to convert in a batch, use @list.txt to "
+            "read them from a file."
+        ),
+    )
+    args_parser.add_argument(
+        "--output",
+        type=str,
+        nargs=1,
+        default=[""],
+        help=(
+            "The .csv file to save to, a .csv.gz, .csv.bz2 or .csv.xz file "
+            "is compressed."
+        ),
+    )
+    args_parser.add_argument(
+        "--shard-by",
+        choices=SHARD_MODES,
+        default=None,
+        help=(
+            "Split the --output into a file for every branch below the root, "
+            "or into files of --shard-rows rows, and write a manifest with "
+            "the row count and sha256 of every file."
+        ),
+    )
+    args_parser.add_argument(
+        "--shard-rows",
+        type=int,
+        default=None,
+        help="The most rows in a shard, implies --shard-by rows.",
+    )
+    args_parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=None,
+        help=(
+            "The compression level of a compressed output, 1 to 9 (6 for gzip "
+            "and xz, 9 for bz2)."
+        ),
+    )
+    args_parser.add_argument(
+        "--sink",
+        type=str,
+        action="append",
+        default=[],
+        help=(
+            "Write an extra output as FORMAT:PATH[:COLUMNS], with FORMAT one "
+            "of csv, tsv or ndjson and COLUMNS a comma separated list of "
+            "numbers, ids and leaf e.g. ndjson:map.jsonl:numbers,ids. Can be "
+            "given many times, the map is only read once."
+        ),
+    )
+    args_parser.add_argument(
+        "--output-sqlite",
+        type=str,
+        default=None,
+        help=(
+            "Write the nodes to the nodes table of this SQLite database, "
+            "with their ids, parent, depth, outline number, leaf flag and "
+            "title. The csv is then only written with --output."
+        ),
+    )
+    args_parser.add_argument(
+        "--closure",
+        help=(
+            "Add a closure table of all ancestor and descendant pairs to the "
+            "--output-sqlite database (False)."
+        ),
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=None,
+        help=(
+            "The folder to save the .csv files to in a batch, defaults to "
+            "the folder of each .mind file."
+        ),
+    )
+    args_parser.add_argument(
+        "--buffer-size",
+        type=int,
+        default=DEFAULT_BUFFER_SIZE,
+        help=(
+            "The size in bytes of the chunks the csv output is written in "
+            f"({DEFAULT_BUFFER_SIZE})."
+        ),
+    )
+    args_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help=(
+            "The number of processes to convert a batch with, or the "
+            "branches of a single map with (1)."
+        ),
+    )
+    args_parser.add_argument(
+        "--worker",
+        help=(
+            "Read jobs from stdin, one per line, and write a JSON status line "
+            "for each to stdout. A job is a .mind file path, an input and "
+            "output path separated by a tab, or a JSON object with input, "
+            "output, numbers, ids, leaf, id_scheme and stream keys (False)."
+        ),
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--numbers",
+        help="Print hierarchy numbers for each item e.g. 1.2.3 (False).",
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--ids",
+        help=(
+            "Generate parent child ids to retain hierarchy relationships "
+            "(False)."
+        ),
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--id-scheme",
+        choices=ID_SCHEMES,
+        default="uuid",
+        help=(
+            "How --ids are generated: a random uuid, the map's own node id "
+            "or a counter (uuid)."
+        ),
+    )
+    args_parser.add_argument(
+        "--leaf",
+        help="Mark leaf nodes with an 'L' (False).",
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--columns",
+        type=str,
+        default=None,
+        help=(
+            "The comma separated columns to write, instead of --numbers, "
+            "--ids and --leaf. Use numbers, ids, parent_id, id, depth, leaf, "
+            "title or a node field e.g. note, link, icon, created_at or "
+            "task.effort."
+        ),
+    )
+    args_parser.add_argument(
+        "--attachments",
+        type=str,
+        default=None,
+        help=(
+            "Extract the attachments and images of the nodes to this folder "
+            "and add their paths in an attachment_files column."
+        ),
+    )
+    args_parser.add_argument(
+        "--max-attachment-size",
+        type=int,
+        default=DEFAULT_MAX_ATTACHMENT_BYTES,
+        help=(
+            "The most bytes of attachments to extract from a map "
+            f"({DEFAULT_MAX_ATTACHMENT_BYTES})."
+        ),
+    )
+    args_parser.add_argument(
+        "--max-compression-ratio",
+        type=float,
+        default=DEFAULT_MAX_COMPRESSION_RATIO,
+        help=(
+            "Refuse attachments that are compressed more than this many "
+            f"times ({DEFAULT_MAX_COMPRESSION_RATIO})."
+        ),
+    )
+    args_parser.add_argument(
+        "--max-depth",
+        type=int,
+        default=None,
+        help=(
+            "Only convert this many levels below the root, or below the "
+            "--subtree, deeper branches are skipped."
+        ),
+    )
+    args_parser.add_argument(
+        "--subtree",
+        type=str,
+        default=None,
+        help="Only convert the branch with this outline number or node id.",
+    )
+    args_parser.add_argument(
+        "--include",
+        type=str,
+        default=None,
+        help=(
+            "Only convert the branches with a title that matches this regular "
+            "expression, and their ancestors."
+        ),
+    )
+    args_parser.add_argument(
+        "--exclude",
+        type=str,
+        default=None,
+        help=(
+            "Skip the branches with a title that matches this regular "
+            "expression."
+        ),
+    )
+    args_parser.add_argument(
+        "--stream",
+        help=(
+            "Read the map incrementally to keep memory use low on very large "
+            "maps (False)."
+        ),
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--cache",
+        type=str,
+        default=None,
+        help=(
+            "Reuse the output of unchanged .mind files from this cache "
+            "folder. With --ids this needs --id-scheme node or counter."
+        ),
+    )
+    args_parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=DEFAULT_CACHE_SIZE,
+        help=f"The maximum size of the cache in bytes ({DEFAULT_CACHE_SIZE}).",
+    )
+    args_parser.add_argument(
+        "--clear-cache",
+        help="Empty the cache folder before converting (False).",
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--diff",
+        type=str,
+        default=None,
+        help=(
+            "Only output the nodes that were added, removed, moved, "
+            "re-parented or retitled since this older .mind file or "
+            "snapshot."
+        ),
+    )
+    args_parser.add_argument(
+        "--save-snapshot",
+        type=str,
+        default=None,
+        help="Save a snapshot of the map to diff the next version against.",
+    )
+    args_parser.add_argument(
+        "--stats",
+        help=(
+            "Print the phase timings and counters of the conversion as JSON "
+            "to stderr (False)."
+        ),
+        action="store_true",
+    )
+    args_parser.add_argument(
+        "--profile",
+        type=str,
+        default=None,
+        help="Save cProfile stats of the run to this file.",
+    )
+    args = args_parser.parse_args()
+
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            run(args_parser, args)
+        finally:
+            profile.disable()
+            profile.dump_stats(args.profile)
+    else:
+        run(args_parser, args)
+
+
+def run(args_parser: argparse.ArgumentParser, args: argparse.Namespace):
+    """
+    Runs the conversion the command line arguments ask for.
+    """
+    options = dict(
+        print_numbers=args.numbers,
+        print_ids=args.ids,
+        print_leaf_nodes=args.leaf,
+        id_scheme=args.id_scheme,
+        max_depth=args.max_depth,
+        subtree=args.subtree,
+        include=args.include,
+        exclude=args.exclude,
+        attachments_dir=args.attachments,
+        max_attachment_bytes=args.max_attachment_size,
+        max_compression_ratio=args.max_compression_ratio,
+    )
+    convert_options = dict(
+        stream=args.stream,
+        buffer_size=args.buffer_size,
+        compression_level=args.compression_level,
+    )
+
+    try:
+        if args.columns:
+            options["columns"] = tuple(parse_columns(args.columns))
+        extractor = MindMeisterExtractor(**options)
+    except ExtractorError as error:
+        args_parser.error(str(error))
+
+    if args.cache:
+        cache = ResultCache(args.cache, args.cache_size)
+        if args.clear_cache:
+            cache.clear()
+        convert_options["cache"] = cache
+
+    if args.worker:
+        if args.file or args.output[0] != "":
+            args_parser.error("--worker reads its files from stdin.")
+        summary = run_worker(
+            sys.stdin,
+            sys.stdout,
+            output_dir=args.output_dir,
+            jobs=args.jobs,
+            convert_options=convert_options,
+            **options,
+        )
+        if summary.failed:
+            sys.exit(1)
+        return
+
+    if not args.file:
+        args_parser.error("the following arguments are required: file")
+
+    is_batch = (
+        len(args.file) > 1
+        or args.output_dir is not None
+        or os.path.isdir(args.file[0])
+        or (glob.has_magic(args.file[0]) and not os.path.exists(args.file[0]))
+    )
+    if is_batch:
+        if args.output[0] != "":
+            args_parser.error("--output can not be used with a batch.")
+        summary = convert_many(
+            args.file,
+            output_dir=args.output_dir,
+            jobs=args.jobs,
+            convert_options=convert_options,
+            **options,
+        )
+        if args.stats:
+            print(
+                json.dumps(
+                    {
+                        "files": len(summary.results),
+                        "failed": len(summary.failed),
+                        "seconds": round(summary.seconds, 6),
+                    }
+                ),
+                file=sys.stderr,
+            )
+        if summary.failed:
+            sys.exit(1)
+        return
+
+    if args.sink or args.output_sqlite or args.shard_by or args.shard_rows:
+        try:
+            write_sinks(extractor, args)
+        except ExtractorError as error:
+            logger.error(error)
+        except IOError as error:
+            logger.error(f"File error: {error}")
+        return
+
+    if args.diff or args.save_snapshot:
+        try:
+            write_snapshot_diff(extractor, args)
+        except ExtractorError as error:
+            logger.error(error)
+        except IOError as error:
+            logger.error(f"File error: {error}")
+        return
+
+    stats = ConversionStats() if args.stats else None
+
+    try:
+        extractor.convert(
+            input_file_path=args.file[0],
+            output_file_path=args.output[0],
+            stats=stats,
+            jobs=args.jobs,
+            **convert_options,
+        )
+
+    except ExtractorError as error:
         logger.error(error)
 
+    if stats is not None:
+        print(json.dumps(stats.as_dict()), file=sys.stderr)
+
+
+def write_sinks(extractor: MindMeisterExtractor, args: argparse.Namespace):
+    """
+    Writes the --sink and --output-sqlite outputs, and --output when it is
+    given with the --columns or sharded, from one walk of the map.
+    """
+    specs = [Sink.parse_spec(spec) for spec in args.sink]
+    shard_by = args.shard_by or ("rows" if args.shard_rows else None)
+    if shard_by is not None and args.output[0] == "":
+        raise ExtractorError("--shard-by needs an --output file to name.")
+    if args.output[0] != "" and shard_by is None:
+        columns: Dict[str, Any] = {"columns": extractor.columns}
+        specs.insert(0, ("csv", args.output[0], columns))
+
+    with ExitStack() as exit_stack:
+        sinks: List[Union[Sink, SqliteSink, ShardSink]] = []
+        if shard_by is not None:
+            shard_sink = ShardSink(
+                args.output[0],
+                shard_by,
+                args.shard_rows,
+                extractor.columns,
+                args.buffer_size,
+                args.compression_level,
+            )
+            exit_stack.callback(shard_sink.close)
+            sinks.append(shard_sink)
+        for format, path, columns in specs:
+            output_file = exit_stack.enter_context(
+                open_output(path, args.compression_level)
+            )
+            columns["buffer_size"] = args.buffer_size
+            sinks.append(Sink(output_file, format, **columns))
+        if args.output_sqlite:
+            sqlite_sink = SqliteSink(args.output_sqlite, args.closure)
+            exit_stack.callback(sqlite_sink.close)
+            sinks.append(sqlite_sink)
+        extractor.write_sinks(args.file[0], sinks, args.stream)
+
+
+def write_snapshot_diff(
+    extractor: MindMeisterExtractor, args: argparse.Namespace
+):
+    """
+    Writes the diff against an older map and saves the snapshot of the map
+    for the --diff and --save-snapshot options.
+    """
+    input_file_path = args.file[0]
+
+    if not args.diff:
+        extractor.convert_file(input_file_path, args.output[0])
+        extractor.snapshot(input_file_path).save(args.save_snapshot)
+        return
+
+    old = extractor.load_snapshot(args.diff)
+    if args.output[0] == "":
+        new = extractor.write_diff(old, input_file_path, sys.stdout)
+        sys.stdout.flush()
+    else:
+        with open_output(
+            args.output[0], args.compression_level
+        ) as output_file:
+            new = extractor.write_diff(old, input_file_path, output_file)
+
+    if args.save_snapshot:
+        new.save(args.save_snapshot)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,329 @@
+"""
+Benchmarks the phases of a conversion on synthetic .mind files.
+
+    python mm2csv/mm2csv_bench.py --breadth 8 --depth 5
+    python mm2csv/mm2csv_bench.py --save-baseline
+    python mm2csv/mm2csv_bench.py --baseline mm2csv/mm2csv_bench.json
+
+When a baseline is given the run fails with exit code 1 if a phase is slower
+or uses more memory than the baseline allows.
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import Optional
+
+from mm2csv import BufferedCsvWriter
+from mm2csv import MindMeisterExtractor
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "mm2csv_bench.json")
+
+
+def generate_node(
+    id: int,
+    rank: Optional[int],
+    title: str,
+    metadata: bool,
+    attachments: Iterator[int],
+) -> Dict[str, Any]:
+    node: Dict[str, Any] = {"id": id, "title": title, "rank": rank}
+
+    if metadata:
+        node.update(
+            {
+                "pos": [None, None],
+                "icon": None,
+                "style": None,
+                "created_at": "2023-10-17T20:49:22.000Z",
+                "updated_at": "2023-10-17T20:49:37.000Z",
+                "note": None,
+                "link": None,
+                "task": {
+                    "from": None,
+                    "until": None,
+                    "resource": None,
+                    "effort": None,
+                    "notify": 1,
+                },
+                "external_task": None,
+            }
+        )
+
+    attachment = next(attachments, None)
+    node["attachments"] = (
+        []
+        if attachment is None
+        else [
+            {
+                "id": attachment,
+                "file_name": f"attachment-{attachment}.bin",
+                "content_type": "application/octet-stream",
+            }
+        ]
+    )
+    node["image"] = None
+    node["children"] = []
+
+    if metadata:
+        node.update(
+            {
+                "boundary": None,
+                "video": None,
+                "property": {
+                    "id": id + 1_000_000_000,
+                    "idea_id": id,
+                    "floating": False,
+                    "offset_x": 0,
+                    "offset_y": 0,
+                    "free": False,
+                    "layout": None,
+                },
+            }
+        )
+
+    return node
+
+
+def generate_map(
+    breadth: int,
+    depth: int,
+    title_length: int = 20,
+    attachments: int = 0,
+    metadata: bool = True,
+) -> Dict[str, Any]:
+    """
+    Generates a map in the shape of a MindMeister map.json with `breadth`
+    children per node and `depth` levels below the root.
+
+    :param breadth: The number of children of every node above the leaves.
+    :param depth: The number of levels below the root.
+    :param title_length: The length of every title.
+    :param attachments: The number of nodes, in order, that get an
+                        attachment.
+    :param metadata: Add the task, style and property fields of a real map.
+    """
+    ids = itertools.count(2_000_000_000)
+    attachment_ids = iter(range(attachments))
+
+    def node(rank: Optional[int], level: int) -> Dict[str, Any]:
+        id = next(ids)
+        title = f"{level}:{id} ".ljust(title_length, "x")[:title_length]
+        return generate_node(id, rank, title, metadata, attachment_ids)
+
+    root = node(None, 0)
+    stack = [(root, 0)]
+    while stack:
+        parent, level = stack.pop()
+        if level == depth:
+            continue
+        parent["children"] = [
+            node(rank, level + 1) for rank in range(1, breadth + 1)
+        ]
+        stack.extend((child, level + 1) for child in parent["children"])
+
+    return {"map_version": "3.0", "root": root, "theme": None, "layout": 1}
+
+
+def write_mind_file(
+    path: str, data: Dict[str, Any], attachment_size: int = 1024
+) -> str:
+    """
+    Writes a map to a .mind archive, with a member for every attachment.
+    """
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("map.json", json.dumps(data))
+        stack = [data["root"]]
+        while stack:
+            node = stack.pop()
+            for attachment in node["attachments"]:
+                zip_file.writestr(
+                    f"attachments/{attachment['id']}/"
+                    f"{attachment['file_name']}",
+                    os.urandom(attachment_size),
+                )
+            stack.extend(node["children"])
+    return path
+
+
+def measure(function: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    """
+    Runs a phase `repeat` times for the best time and once more under
+    tracemalloc for the peak memory.
+    """
+    seconds = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": seconds, "peak_bytes": peak}
+
+
+def run(path: str, repeat: int = 3) -> Dict[str, Dict[str, float]]:
+    """
+    Times the phases of `MindMeisterExtractor.convert` for a .mind file:
+
+    - read: reading the map.json bytes out of the archive.
+    - decode: decoding the map.json bytes.
+    - walk: visiting every node.
+    - write: formatting and writing the csv rows, including the walk.
+    - convert: a whole in-memory conversion.
+    - stream: a whole conversion with the streaming reader.
+    """
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=True,
+        print_leaf_nodes=True,
+        id_scheme="counter",
+    )
+
+    def read() -> bytes:
+        with extractor.open_map(path) as map_file:
+            return map_file.read()
+
+    map_bytes = read()
+    root = json.loads(map_bytes)["root"]
+
+    def write():
+        extractor.write_rows(
+            extractor.walk(root, "0"), BufferedCsvWriter(io.StringIO())
+        )
+
+    return {
+        "read": measure(read, repeat),
+        "decode": measure(lambda: json.loads(map_bytes), repeat),
+        "walk": measure(
+            lambda: all(True for _ in extractor.walk(root, "0")), repeat
+        ),
+        "write": measure(write, repeat),
+        "convert": measure(lambda: extractor.convert_bytes(path), repeat),
+        "stream": measure(
+            lambda: extractor.convert_bytes(path, stream=True), repeat
+        ),
+    }
+
+
+def compare(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    time_tolerance: float,
+    memory_tolerance: float,
+) -> Iterator[str]:
+    """
+    :returns: A message for every phase that regressed against the baseline.
+    """
+    for phase, result in results.items():
+        if phase not in baseline:
+            continue
+        limit = baseline[phase]["seconds"] * time_tolerance
+        if result["seconds"] > limit:
+            yield (
+                f"{phase}: {result['seconds']:.3f}s is slower than the "
+                f"{limit:.3f}s allowed"
+            )
+        limit = baseline[phase]["peak_bytes"] * memory_tolerance
+        if result["peak_bytes"] > limit:
+            yield (
+                f"{phase}: {result['peak_bytes']:.0f} bytes is more than the "
+                f"{limit:.0f} bytes allowed"
+            )
+
+
+def main():
+    args_parser = argparse.ArgumentParser(
+        description="Benchmarks mm2csv on a synthetic .mind file."
+    )
+    args_parser.add_argument("--breadth", type=int, default=6)
+    args_parser.add_argument("--depth", type=int, default=5)
+    args_parser.add_argument("--title-length", type=int, default=20)
+    args_parser.add_argument("--attachments", type=int, default=0)
+    args_parser.add_argument(
+        "--no-metadata",
+        help="Leave the task, style and property fields out of the nodes.",
+        action="store_true",
+    )
+    args_parser.add_argument("--repeat", type=int, default=3)
+    args_parser.add_argument(
+        "--baseline",
+        type=str,
+        default=None,
+        help="Fail if the results regressed against this baseline file.",
+    )
+    args_parser.add_argument(
+        "--save-baseline",
+        nargs="?",
+        const=BASELINE_PATH,
+        default=None,
+        help=f"Save the results as the baseline ({BASELINE_PATH}).",
+    )
+    args_parser.add_argument(
+        "--time-tolerance",
+        type=float,
+        default=1.5,
+        help="The allowed slowdown against the baseline (1.5).",
+    )
+    args_parser.add_argument(
+        "--memory-tolerance",
+        type=float,
+        default=1.2,
+        help="The allowed memory growth against the baseline (1.2).",
+    )
+    args = args_parser.parse_args()
+
+    data = generate_map(
+        args.breadth,
+        args.depth,
+        args.title_length,
+        args.attachments,
+        not args.no_metadata,
+    )
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = write_mind_file(os.path.join(temp_dir, "bench.mind"), data)
+        results = run(path, args.repeat)
+
+    for phase, result in results.items():
+        print(
+            f"{phase:>8}: {result['seconds'] * 1000:10.1f} ms "
+            f"{result['peak_bytes'] / 1e6:10.1f} MB peak"
+        )
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        regressions = list(
+            compare(
+                results, baseline, args.time_tolerance, args.memory_tolerance,
+            )
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
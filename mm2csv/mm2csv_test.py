@@ -1,11 +1,42 @@
+import asyncio
+import bz2
+import copy
+import csv
+import gzip
+import hashlib
 import io
+import lzma
+import os
+import sys
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
 
 import pytest
+import sqlite3
 import json
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Tuple
 
+from mm2csv import BufferedCsvWriter
+from mm2csv import ConversionServer
+from mm2csv import ConversionStats
+from mm2csv import ExtractorError
+from mm2csv import FolderWatcher
+from mm2csv import MapSnapshot
+from mm2csv import MapTooDeepError
 from mm2csv import MindMeisterExtractor
+from mm2csv import ResultCache
+from mm2csv import SearchIndex
+from mm2csv import Sink
+from mm2csv import SqliteSink
+from mm2csv import convert_many
+from mm2csv import main
+from mm2csv import ndjson_rows
+from mm2csv import run_worker
+from mm2csv_bench import generate_map
+from mm2csv_bench import write_mind_file
 
 
 @pytest.fixture
@@ -541,3 +572,1347 @@ def test_parse(data: Dict[str, Any]):
         "1.2.2.1,id.id,L,sub sub level 2.2.1\r\n"
         "1.3,id.id,L,level 3\r\n"
     )
+
+
+@pytest.fixture
+def mind_file(tmp_path, data: Dict[str, Any]) -> str:
+    path = tmp_path / "map.mind"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("map.json", json.dumps(data))
+        zip_file.writestr("images/image.png", b"\x89PNG")
+    return str(path)
+
+
+def test_convert_reads_map_from_archive(mind_file: str, tmp_path, monkeypatch):
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=False, print_leaf_nodes=True,
+    )
+
+    def unzip(*args, **kwargs):
+        raise AssertionError("convert should not extract the archive")
+
+    monkeypatch.setattr(extractor, "unzip", unzip)
+    output_path = tmp_path / "map.csv"
+    extractor.convert(mind_file, str(output_path))
+
+    output = output_path.read_text()
+    assert output.startswith("1,,root\n1.1,,level 1\n")
+    assert output.endswith("1.3,L,level 3\n")
+
+
+def test_convert_extracts_when_asked(mind_file: str, tmp_path):
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=False, print_leaf_nodes=False,
+    )
+    extract_dir = tmp_path / "extracted"
+    extractor.convert(mind_file, str(tmp_path / "map.csv"), str(extract_dir))
+
+    assert list(extract_dir.rglob("image.png"))
+
+
+def test_load_map_rejects_archive_without_map(tmp_path):
+    path = tmp_path / "empty.mind"
+    with zipfile.ZipFile(path, "w") as zip_file:
+        zip_file.writestr("other.json", "{}")
+
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=False, print_leaf_nodes=False,
+    )
+    with pytest.raises(ExtractorError):
+        extractor.load_map(str(path))
+
+
+def test_parse_deep_map():
+    depth = 10_000
+    root: Dict[str, Any] = {"title": "0", "children": []}
+    node = root
+    for level in range(1, depth):
+        child = {"title": str(level), "children": []}
+        node["children"].append(child)
+        node = child
+
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=False, print_leaf_nodes=True,
+    )
+    extractor.output_file = io.StringIO()
+    extractor.csv_writer = extractor.init_csv_writer()
+    extractor.parse(parent_id="", depth=0, numbers="1", node=root)
+
+    lines = extractor.output_file.getvalue().splitlines()
+    assert len(lines) == depth
+    assert lines[0] == ",0"
+    assert lines[-1] == f"L,{depth - 1}"
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_stream_walk_matches_walk(data: Dict[str, Any], chunk_size: int):
+    data["root"]["children"][0]["title"] = 'quote " and \\ and é'
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=True, print_leaf_nodes=True,
+    )
+    extractor.generate_id = lambda: "id"
+
+    expected = [
+        (node.get("title"), parent_id, id, depth, numbers, has_children)
+        for node, parent_id, id, depth, numbers, has_children in (
+            extractor.walk(data["root"], "id")
+        )
+    ]
+    visits = extractor.stream_walk(
+        io.StringIO(json.dumps(data, indent=2)), "id", chunk_size
+    )
+
+    assert [
+        (node.get("title"), parent_id, id, depth, numbers, has_children)
+        for node, parent_id, id, depth, numbers, has_children in visits
+    ] == expected
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"max_depth": 1},
+        {"max_depth": 0},
+        {"subtree": "1.2"},
+        {"subtree": "1.3.1", "max_depth": 1},
+        {"subtree": "2000000005"},
+        {"exclude": "^2:"},
+        {"include": "2000000014"},
+        {"include": "^2:2000000018", "subtree": "1.2"},
+    ],
+)
+def test_walk_prunes_branches(options: Dict[str, Any]):
+    data = generate_map(3, 3, metadata=False)
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=True,
+        print_leaf_nodes=False,
+        id_scheme="node",
+        **options,
+    )
+
+    visits = [
+        (numbers, f"{parent_id}.{id}", has_children)
+        for _, parent_id, id, _, numbers, has_children in extractor.walk(
+            data["root"], "0"
+        )
+    ]
+    for chunk_size in (16, 1 << 16):
+        assert [
+            (numbers, f"{parent_id}.{id}", has_children)
+            for _, parent_id, id, _, numbers, has_children in (
+                extractor.stream_walk(
+                    io.StringIO(json.dumps(data)), "0", chunk_size
+                )
+            )
+        ] == visits
+
+    numbers = [visit[0] for visit in visits]
+    if options == {"max_depth": 1}:
+        assert numbers == ["1", "1.1", "1.2", "1.3"]
+        assert visits[1][2]
+    elif options == {"max_depth": 0}:
+        assert numbers == ["1"]
+    elif options == {"subtree": "1.2"}:
+        assert numbers[:3] == ["1.2", "1.2.1", "1.2.1.1"]
+        assert len(numbers) == 13
+        assert visits[0][1] == "0.2000000002"
+    elif options == {"subtree": "1.3.1", "max_depth": 1}:
+        assert numbers == ["1.3.1", "1.3.1.1", "1.3.1.2", "1.3.1.3"]
+    elif options == {"subtree": "2000000005"}:
+        assert numbers == ["1.3.2", "1.3.2.1", "1.3.2.2", "1.3.2.3"]
+    elif options == {"exclude": "^2:"}:
+        assert numbers == ["1", "1.1", "1.2", "1.3"]
+    elif options == {"include": "2000000014"}:
+        assert numbers == ["1", "1.3", "1.3.1", "1.3.1.2"]
+        assert visits[-1][1] == "2000000004.2000000014"
+    else:
+        assert numbers == ["1.2", "1.2.3", "1.2.3.1", "1.2.3.2", "1.2.3.3"]
+
+
+def test_walk_rejects_missing_subtree(data: Dict[str, Any]):
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=False,
+        print_leaf_nodes=False,
+        subtree="1.9",
+    )
+    with pytest.raises(ExtractorError):
+        list(extractor.walk(data["root"], "0"))
+    with pytest.raises(ExtractorError):
+        list(extractor.stream_walk(io.StringIO(json.dumps(data)), "0"))
+
+
+@pytest.fixture
+def deep_mind_file(tmp_path) -> str:
+    """
+    A map nested deeper than json.loads can decode.
+    """
+    map_json = (
+        '{"map_version": "3.0", "root": '
+        + '{"title": "node", "style": {"a": [1, "}"]}, "children": [' * 10_000
+        + "]}" * 10_000
+        + "}"
+    )
+    path = tmp_path / "deep.mind"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("map.json", map_json)
+    return str(path)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_stream_deep_map(tmp_path, deep_mind_file: str, stream: bool):
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=False, print_leaf_nodes=True,
+    )
+    output_path = tmp_path / "deep.csv"
+    # Without streaming the map is too deep to load, and it is streamed.
+    extractor.convert(deep_mind_file, str(output_path), stream=stream)
+
+    lines = output_path.read_text().splitlines()
+    assert len(lines) == 10_000
+    assert lines[-2:] == [",node", "L,node"]
+
+    with pytest.raises(MapTooDeepError):
+        extractor.load_map(deep_mind_file)
+
+
+def test_main_converts_deep_map(tmp_path, deep_mind_file: str, monkeypatch):
+    output_path = tmp_path / "deep.csv"
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["mm2csv", "--leaf", "--output", str(output_path), deep_mind_file],
+    )
+    main()
+
+    assert len(output_path.read_text().splitlines()) == 10_000
+
+
+def test_stream_rejects_map_without_root():
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=False, print_leaf_nodes=False,
+    )
+    with pytest.raises(ExtractorError):
+        list(extractor.stream_walk(io.StringIO('{"map_version": 3}'), "id"))
+
+
+def test_stream_rejects_field_after_children(data: Dict[str, Any]):
+    data["root"]["property"] = {"layout": "mind_map"}
+    extractor = MindMeisterExtractor(
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+        columns=["numbers", "property.layout", "title"],
+    )
+    source = io.BytesIO()
+    with zipfile.ZipFile(source, "w") as zip_file:
+        zip_file.writestr("map.json", json.dumps(data))
+
+    assert extractor.convert_bytes(source.getvalue()).startswith(
+        "1,mind_map,root\r\n"
+    )
+    with pytest.raises(ExtractorError, match="'property' after its children"):
+        extractor.convert_bytes(source.getvalue(), stream=True)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_convert_many(mind_file: str, tmp_path, jobs: int):
+    inputs = tmp_path / "inputs"
+    (inputs / "team").mkdir(parents=True)
+    for name in ("a.mind", "team/b.mind"):
+        (inputs / name).write_bytes(open(mind_file, "rb").read())
+    (inputs / "broken.mind").write_text("not a zip file")
+
+    summary = convert_many(
+        [str(inputs)],
+        output_dir=str(tmp_path / "out"),
+        jobs=jobs,
+        print_numbers=True,
+        print_ids=False,
+        print_leaf_nodes=False,
+    )
+
+    assert [os.path.basename(r.input_file_path) for r in summary.results] == [
+        "a.mind",
+        "broken.mind",
+        "b.mind",
+    ]
+    assert len(summary.succeeded) == 2
+    assert len(summary.failed) == 1
+    assert (
+        (tmp_path / "out" / "team" / "b.csv")
+        .read_text()
+        .startswith("1,root\n")
+    )
+    # A failed conversion does not leave an empty output behind.
+    assert sorted(os.listdir(tmp_path / "out")) == ["a.csv", "team"]
+
+
+def test_convert_bracketed_file_name(
+    mind_file: str, tmp_path, monkeypatch, capsys
+):
+    input_path = tmp_path / "plan[v2].mind"
+    input_path.write_bytes(open(mind_file, "rb").read())
+    monkeypatch.setattr(sys, "argv", ["mm2csv", "--numbers", str(input_path)])
+    main()
+
+    assert capsys.readouterr().out.startswith("1,root\r\n")
+
+    summary = convert_many(
+        [str(input_path), str(tmp_path / "missing[0-9].mind")],
+        output_dir=str(tmp_path / "out"),
+        print_numbers=True,
+        print_ids=False,
+        print_leaf_nodes=False,
+    )
+    assert [r.error for r in summary.results] == [
+        None,
+        f"No files match {tmp_path / 'missing[0-9].mind'}",
+    ]
+    assert os.listdir(tmp_path / "out") == ["plan[v2].csv"]
+
+
+def test_convert_file_keeps_output_on_error(mind_file: str, tmp_path):
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=False, print_leaf_nodes=False,
+    )
+    output_path = tmp_path / "map.csv"
+    output_path.write_text("last good output\n")
+    output_path.chmod(0o640)
+    broken_path = tmp_path / "broken.mind"
+    broken_path.write_text("not a zip file")
+
+    with pytest.raises(ExtractorError):
+        extractor.convert_file(str(broken_path), str(output_path))
+    assert output_path.read_text() == "last good output\n"
+
+    extractor.convert_file(mind_file, str(output_path))
+    assert output_path.read_text().startswith("1,root\n")
+    assert output_path.stat().st_mode & 0o777 == 0o640
+    assert sorted(os.listdir(tmp_path)) == [
+        "broken.mind",
+        "map.csv",
+        "map.mind",
+    ]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_convert_bytes_from_many_threads(mind_file: str, stream: bool):
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=False, print_leaf_nodes=True,
+    )
+    with open(mind_file, "rb") as file:
+        source = file.read()
+    expected = extractor.convert_bytes(io.BytesIO(source), stream=stream)
+
+    with ThreadPoolExecutor(8) as executor:
+        outputs = list(
+            executor.map(
+                lambda _: extractor.convert_bytes(source, stream=stream),
+                range(32),
+            )
+        )
+
+    assert expected.startswith("1,,root\r\n")
+    assert outputs == [expected] * 32
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_id_schemes(mind_file: str, stream: bool):
+    def ids(id_scheme: str) -> List[str]:
+        extractor = MindMeisterExtractor(
+            print_numbers=False,
+            print_ids=True,
+            print_leaf_nodes=False,
+            id_scheme=id_scheme,
+        )
+        output = extractor.convert_bytes(mind_file, stream=stream)
+        return [line.split(",")[0] for line in output.splitlines()]
+
+    assert ids("counter")[:3] == ["0.1", "1.2", "2.3"]
+    assert ids("counter")[-1] == "1.10"
+    assert ids("node")[:2] == ["0.2997460696", "2997460696.2997460697"]
+    assert ids("node") == ids("node")
+    assert ids("uuid") != ids("uuid")
+
+
+def test_unknown_id_scheme():
+    with pytest.raises(ExtractorError):
+        MindMeisterExtractor(
+            print_numbers=False,
+            print_ids=True,
+            print_leaf_nodes=False,
+            id_scheme="random",
+        )
+
+
+@pytest.mark.parametrize("buffer_size", [1, 64, 1 << 20])
+def test_buffered_csv_writer_matches_csv_writer(buffer_size: int):
+    rows = [[str(number), 'a "quoted", title\r'] for number in range(3000)]
+    expected = io.StringIO()
+    csv.writer(expected).writerows(rows)
+
+    output = io.StringIO()
+    writer = BufferedCsvWriter(output, buffer_size, batch_size=100)
+    writer.writerows(iter(rows))
+
+    assert output.getvalue() == expected.getvalue()
+
+
+def test_bench_generate_map(tmp_path):
+    data = generate_map(breadth=3, depth=4, attachments=5)
+    path = write_mind_file(str(tmp_path / "bench.mind"), data)
+
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=False, print_leaf_nodes=False,
+    )
+    output = extractor.convert_bytes(path)
+
+    assert len(output.splitlines()) == 1 + 3 + 9 + 27 + 81
+    assert extractor.convert_bytes(path, stream=True) == output
+    with zipfile.ZipFile(path) as zip_file:
+        assert len(zip_file.namelist()) == 6
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_conversion_stats(mind_file: str, stream: bool):
+    reported = []
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=False,
+        print_leaf_nodes=False,
+        on_stats=reported.append,
+    )
+    output = extractor.convert_bytes(mind_file, stream=stream)
+
+    stats = reported[0].as_dict()
+    assert stats["nodes"] == 10
+    assert stats["rows"] == 10
+    assert stats["max_depth"] == 3
+    assert stats["bytes_written"] == len(output)
+    assert stats["bytes_read"] > 0
+    assert "parse" in stats["phases"] and "write" in stats["phases"]
+
+
+def test_result_cache(mind_file: str, tmp_path, monkeypatch):
+    cache = ResultCache(str(tmp_path / "cache"))
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=True,
+        print_leaf_nodes=False,
+        id_scheme="node",
+    )
+    first = tmp_path / "first.csv"
+    extractor.convert_file(mind_file, str(first), cache=cache)
+
+    def open_map(*args, **kwargs):
+        raise AssertionError("a cache hit should not open the archive")
+
+    monkeypatch.setattr(extractor, "open_map", open_map)
+    second = tmp_path / "second.csv"
+    extractor.convert_file(mind_file, str(second), cache=cache)
+
+    assert second.read_bytes() == first.read_bytes()
+    assert len(cache.entries()) == 1
+
+    cache.clear()
+    assert cache.entries() == []
+
+
+def test_result_cache_too_small_keeps_stats(mind_file: str, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1)
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=False, print_leaf_nodes=False,
+    )
+    stats = ConversionStats()
+    output = tmp_path / "map.csv"
+    extractor.convert_file(mind_file, str(output), stats=stats, cache=cache)
+
+    assert cache.entries() == []
+    assert output.read_text().startswith("1,root\n")
+    assert stats.rows == 10
+    assert stats.bytes_written == len(output.read_bytes())
+
+
+def test_result_cache_skips_random_ids(mind_file: str, tmp_path):
+    cache = ResultCache(str(tmp_path / "cache"))
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=True, print_leaf_nodes=False,
+    )
+    extractor.convert_file(mind_file, str(tmp_path / "map.csv"), cache=cache)
+
+    assert cache.entries() == []
+
+
+def test_result_cache_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=10)
+    for number, key in enumerate(["a", "b", "c"]):
+        with cache.put(key) as file:
+            file.write("12345")
+        os.utime(cache.path(key), (number, number))
+    cache.evict()
+
+    assert sorted(os.path.basename(entry[2]) for entry in cache.entries()) == [
+        "b.csv",
+        "c.csv",
+    ]
+
+
+def test_diff(data: Dict[str, Any], tmp_path):
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=False, print_leaf_nodes=False,
+    )
+    old = MapSnapshot.from_root(copy.deepcopy(data["root"]))
+    old.save(str(tmp_path / "old.json"))
+    old = MapSnapshot.load(str(tmp_path / "old.json"))
+
+    root = data["root"]
+    level_1, level_2, level_3 = root["children"]
+    level_1["children"][0]["title"] = "renamed\t1.1"
+    level_2["children"].reverse()
+    level_3["children"] = [level_1["children"].pop()]
+    root["children"].append({"id": 1, "title": "new", "children": []})
+    del level_2["children"][0]["children"][0]
+
+    path = tmp_path / "new.mind"
+    with zipfile.ZipFile(path, "w") as zip_file:
+        zip_file.writestr("map.json", json.dumps(data))
+    output = io.StringIO()
+    new = extractor.write_diff(old, str(path), output)
+
+    assert output.getvalue().splitlines() == [
+        "retitled,1.1.1,2997460698,2997460697,renamed 1.1",
+        "moved,1.2.1,2997461863,2997460699,sub level 2.2",
+        "moved,1.2.2,2997460700,2997460699,sub level 2.1",
+        "reparented,1.3.1,2997461753,2997463567,sub level 1.2",
+        "added,1.4,1,2997460696,new",
+        "removed,1.2.2.1,2997461994,2997461863,sub sub level 2.2.1",
+    ]
+    assert list(new.diff(new)) == []
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_map_tree(mind_file: str, stream: bool):
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=True,
+        print_leaf_nodes=True,
+        id_scheme="node",
+    )
+    tree = extractor.load_tree(mind_file, stream=stream)
+    output = io.StringIO()
+    extractor.write_tree(tree, output)
+
+    assert len(tree) == 10
+    assert output.getvalue() == extractor.convert_bytes(mind_file)
+    assert [tree.title(child) for child in tree.children(0)] == [
+        "level 1",
+        "level 2",
+        "level 3",
+    ]
+    (index,) = tree.find("2.2.1$")
+    assert tree.numbers(index) == "1.2.2.1"
+    assert [tree.title(parent) for parent in tree.ancestors(index)] == [
+        "sub level 2.2",
+        "level 2",
+        "root",
+    ]
+
+    subtree = io.StringIO()
+    extractor.write_tree(tree, subtree, start=tree.parent[index])
+    assert subtree.getvalue().splitlines()[1].startswith("1.2.2.1,")
+
+
+@pytest.mark.parametrize(
+    "option", [{"subtree": "1.2"}, {"include": "2.1"}, {"exclude": "level 2"}]
+)
+def test_map_tree_rejects_pruned_maps(mind_file: str, option: Dict):
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=False, print_leaf_nodes=False, **option,
+    )
+    with pytest.raises(ExtractorError):
+        extractor.load_tree(mind_file)
+
+
+def test_map_tree_max_depth(mind_file: str):
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=False,
+        print_leaf_nodes=False,
+        max_depth=1,
+    )
+    tree = extractor.load_tree(mind_file)
+    output = io.StringIO()
+    extractor.write_tree(tree, output)
+
+    assert len(tree) == 4
+    assert output.getvalue() == extractor.convert_bytes(mind_file)
+
+
+def test_write_sinks(mind_file: str, monkeypatch):
+    extractor = MindMeisterExtractor(
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+        id_scheme="counter",
+    )
+    loads = []
+    load_map = extractor.load_map
+    monkeypatch.setattr(
+        extractor,
+        "load_map",
+        lambda source: loads.append(source) or load_map(source),
+    )
+    outputs = [io.StringIO() for _ in range(3)]
+    extractor.write_sinks(
+        mind_file,
+        [
+            Sink(outputs[0], "csv", print_numbers=True, print_leaf_nodes=True),
+            Sink(outputs[1], "tsv", print_ids=True),
+            Sink(outputs[2], "ndjson", print_numbers=True, print_ids=True),
+        ],
+    )
+
+    assert len(loads) == 1
+    assert outputs[0].getvalue().splitlines()[:2] == [
+        "1,,root",
+        "1.1,,level 1",
+    ]
+    assert outputs[1].getvalue().splitlines()[:2] == [
+        "0.1\troot",
+        "1.2\tlevel 1",
+    ]
+    rows = [json.loads(line) for line in outputs[2].getvalue().splitlines()]
+    assert rows[1] == {
+        "number": "1.1",
+        "parent_id": "1",
+        "id": "2",
+        "title": "level 1",
+    }
+
+
+def test_sink_spec():
+    assert Sink.parse_spec("ndjson:out/map.jsonl:numbers,leaf") == (
+        "ndjson",
+        "out/map.jsonl",
+        {"print_numbers": True, "print_leaf_nodes": True},
+    )
+    assert Sink.parse_spec("csv:map.csv") == ("csv", "map.csv", {})
+    with pytest.raises(ExtractorError):
+        Sink.parse_spec("xml:map.xml")
+
+
+def test_conversion_server(mind_file: str):
+    async def request(port: int, head: str, body: bytes = b"") -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(head.encode() + b"\r\n\r\n" + body)
+        await writer.drain()
+        response = await reader.read()
+        writer.close()
+        return response
+
+    async def run() -> List[bytes]:
+        server = ConversionServer(
+            port=0, workers=2, threads=True, max_upload=1 << 20
+        )
+        await server.start()
+        try:
+            with open(mind_file, "rb") as file:
+                body = file.read()
+            return [
+                await request(
+                    server.port,
+                    "POST /convert?numbers=1&leaf=1&id_scheme=node "
+                    f"HTTP/1.1\r\nContent-Length: {len(body)}",
+                    body,
+                ),
+                await request(
+                    server.port,
+                    "POST /convert HTTP/1.1\r\nContent-Length: 2000000",
+                ),
+                await request(server.port, "POST /convert HTTP/1.1"),
+                await request(
+                    server.port,
+                    "POST /convert HTTP/1.1\r\nContent-Length: 3",
+                    b"bad",
+                ),
+                await request(server.port, "GET /metrics HTTP/1.1"),
+            ]
+        finally:
+            await server.close()
+
+    converted, too_large, no_length, bad, metrics = asyncio.run(run())
+
+    head, _, csv_text = converted.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    assert csv_text.decode().splitlines()[:2] == [
+        "1,,root",
+        "1.1,,level 1",
+    ]
+    assert too_large.startswith(b"HTTP/1.1 413 ")
+    assert no_length.startswith(b"HTTP/1.1 411 ")
+    assert bad.startswith(b"HTTP/1.1 422 ")
+    metrics = json.loads(metrics.partition(b"\r\n\r\n")[2])
+    assert metrics["converted"] == 1
+    assert metrics["failed"] == 1
+    assert metrics["rejected"] == 1
+    assert metrics["active"] == 0
+
+
+def test_conversion_server_timeout(mind_file: str, monkeypatch):
+    module = sys.modules[ConversionServer.__module__]
+    convert_upload = module.convert_upload
+
+    def slow_convert_upload(*args) -> str:
+        time.sleep(0.5)
+        return convert_upload(*args)
+
+    monkeypatch.setattr(module, "convert_upload", slow_convert_upload)
+
+    async def run() -> Tuple[bytes, bytes, Dict[str, float]]:
+        server = ConversionServer(port=0, workers=1, threads=True)
+        server.timeout = 0.2
+        await server.start()
+        try:
+            with open(mind_file, "rb") as file:
+                body = file.read()
+            # A conversion slower than the timeout still succeeds.
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", server.port
+            )
+            writer.write(
+                f"POST /convert HTTP/1.1\r\nContent-Length: {len(body)}"
+                "\r\n\r\n".encode() + body
+            )
+            converted = await reader.read()
+            writer.close()
+
+            # A body that never arrives does not.
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", server.port
+            )
+            writer.write(
+                b"POST /convert HTTP/1.1\r\nContent-Length: 9\r\n\r\n"
+            )
+            timed_out = await reader.read()
+            writer.close()
+            return converted, timed_out, server.metrics
+        finally:
+            await server.close()
+
+    converted, timed_out, metrics = asyncio.run(run())
+
+    assert converted.startswith(b"HTTP/1.1 200 OK")
+    assert timed_out.startswith(b"HTTP/1.1 408 ")
+    assert metrics["converted"] == 1
+    assert metrics["active"] == 0
+
+
+def test_conversion_server_admits_uploads(mind_file: str):
+    async def run() -> Tuple[bytes, bytes, Dict[str, float]]:
+        server = ConversionServer(
+            port=0, workers=1, threads=True, max_pending=0
+        )
+        await server.start()
+        try:
+            with open(mind_file, "rb") as file:
+                body = file.read()
+            head = f"POST /convert HTTP/1.1\r\nContent-Length: {len(body)}"
+            # An idle worker takes an upload even without pending room.
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", server.port
+            )
+            writer.write(head.encode() + b"\r\n\r\n")
+            await writer.drain()
+            while not server.metrics["admitted"]:
+                await asyncio.sleep(0.01)
+
+            # The upload being read counts, so the next one is turned away
+            # before its body is read.
+            busy_reader, busy_writer = await asyncio.open_connection(
+                "127.0.0.1", server.port
+            )
+            busy_writer.write(head.encode() + b"\r\n\r\n")
+            busy = await busy_reader.read()
+            busy_writer.close()
+
+            writer.write(body)
+            converted = await reader.read()
+            writer.close()
+            return converted, busy, server.metrics
+        finally:
+            await server.close()
+
+    converted, busy, metrics = asyncio.run(run())
+
+    assert converted.startswith(b"HTTP/1.1 200 OK")
+    assert busy.startswith(b"HTTP/1.1 503 ")
+    assert metrics["admitted"] == 0
+    assert metrics["rejected"] == 1
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_worker(mind_file: str, tmp_path, jobs: int):
+    lines = [
+        mind_file,
+        f"{mind_file}\t{tmp_path / 'tab.csv'}",
+        json.dumps(
+            {
+                "input": mind_file,
+                "output": str(tmp_path / "json.csv"),
+                "numbers": True,
+                "stream": True,
+            }
+        ),
+        str(tmp_path / "missing.mind"),
+        '{"output": "no input"}',
+        "",
+    ]
+    status_file = io.StringIO()
+
+    summary = run_worker(
+        lines,
+        status_file,
+        output_dir=str(tmp_path),
+        jobs=jobs,
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+    )
+
+    statuses = [
+        json.loads(line) for line in status_file.getvalue().splitlines()
+    ]
+    assert [status["status"] for status in statuses] == [
+        "ok",
+        "ok",
+        "ok",
+        "error",
+        "error",
+    ]
+    assert statuses[0]["output"] == str(tmp_path / "map.csv")
+    assert len(summary.failed) == 2
+    with open(tmp_path / "json.csv") as file:
+        assert file.readline() == "1,root\n"
+    with open(tmp_path / "tab.csv") as file:
+        assert file.readline() == "root\n"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_worker_keeps_going_after_bad_jobs(
+    mind_file: str, tmp_path, jobs: int
+):
+    bracketed_path = tmp_path / "plan[v2].mind"
+    bracketed_path.write_bytes(open(mind_file, "rb").read())
+    lines = [
+        json.dumps({"input": mind_file, "max_depth": "2"}),
+        json.dumps({"input": mind_file, "max_depth": True}),
+        json.dumps({"input": mind_file, "columns": 5}),
+        json.dumps({"input": mind_file, "columns": [5]}),
+        json.dumps({"input": 5}),
+        json.dumps({"input": mind_file, "numbers": [1]}),
+        json.dumps({"input": mind_file, "stream": "yes"}),
+        str(tmp_path / "missing[0-9].mind"),
+        str(bracketed_path),
+        json.dumps({"input": mind_file, "columns": ["numbers", "title"]}),
+    ]
+    status_file = io.StringIO()
+
+    summary = run_worker(
+        lines,
+        status_file,
+        output_dir=str(tmp_path / "out"),
+        jobs=jobs,
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+    )
+
+    statuses = [
+        json.loads(line) for line in status_file.getvalue().splitlines()
+    ]
+    assert [status["status"] for status in statuses] == ["error"] * 8 + [
+        "ok",
+        "ok",
+    ]
+    assert statuses[7]["output"] == str(tmp_path / "out" / "missing[0-9].csv")
+    assert len(summary.failed) == 8
+    with open(tmp_path / "out" / "plan[v2].csv") as file:
+        assert file.readline() == "root\n"
+    with open(tmp_path / "out" / "map.csv") as file:
+        assert file.readline() == "1,root\n"
+
+
+def test_convert_many_with_column_list(mind_file: str, tmp_path):
+    summary = convert_many(
+        [mind_file],
+        output_dir=str(tmp_path),
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+        columns=["numbers", "title"],
+    )
+
+    assert not summary.failed
+    with open(tmp_path / "map.csv") as file:
+        assert file.readline() == "1,root\n"
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_run_worker_reports_before_next_line(
+    mind_file: str, tmp_path, jobs: int
+):
+    reported = threading.Event()
+
+    class StatusFile(io.StringIO):
+        def write(self, text: str) -> int:
+            reported.set()
+            return super().write(text)
+
+    def lines() -> Iterator[str]:
+        yield mind_file
+        # A controller waits for the status of a job before the next one.
+        assert reported.wait(30)
+        for index in range(6):
+            yield f"{mind_file}\t{tmp_path / f'{index}.csv'}"
+
+    status_file = StatusFile()
+    summary = run_worker(
+        lines(),
+        status_file,
+        output_dir=str(tmp_path),
+        jobs=jobs,
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+    )
+
+    assert len(summary.results) == 7
+    assert not summary.failed
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_convert_columns(tmp_path, data: Dict[str, Any], stream: bool):
+    root = data["root"]
+    root["title"] = "root\r\nline\ttab\x07"
+    root["note"] = "a note,\nwith a comma"
+    root["task"] = {"effort": 2.5, "from": None}
+    root["children"][0]["task"] = None
+    extractor = MindMeisterExtractor(
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+        id_scheme="counter",
+        columns=["numbers", "id", "depth", "title", "note", "task.effort"],
+    )
+
+    path = write_mind_file(str(tmp_path / "columns.mind"), data)
+    output = extractor.convert_bytes(path, stream=stream)
+
+    rows = list(csv.reader(io.StringIO(output)))
+    assert rows[:2] == [
+        ["1", "1", "0", "root  line tab ", "a note, with a comma", "2.5"],
+        ["1.1", "2", "1", "level 1", "", ""],
+    ]
+
+
+def test_ndjson_rows_columns(data: Dict[str, Any]):
+    data["root"]["task"] = {"effort": 3}
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=False, print_leaf_nodes=False
+    )
+
+    rows = list(
+        ndjson_rows(
+            extractor.walk(data["root"], "0"),
+            columns=["ids", "leaf", "title", "task.effort"],
+        )
+    )
+
+    assert rows[0]["leaf"] is False
+    assert rows[0]["task.effort"] == 3
+    assert rows[0]["title"] == "root"
+    assert set(rows[0]) == {"parent_id", "id", "leaf", "title", "task.effort"}
+
+
+def test_columns_reject_incorrect_names():
+    with pytest.raises(ExtractorError):
+        MindMeisterExtractor(
+            print_numbers=False,
+            print_ids=False,
+            print_leaf_nodes=False,
+            columns=["title", "task..effort"],
+        )
+
+
+def test_read_map_memory_maps_stored_map(tmp_path, data: Dict[str, Any]):
+    stored = tmp_path / "stored.mind"
+    with zipfile.ZipFile(stored, "w", zipfile.ZIP_STORED) as zip_file:
+        zip_file.writestr("images/image.png", b"\x89PNG")
+        zip_file.writestr("map.json", json.dumps(data))
+    extracted = tmp_path / "map.json"
+    extracted.write_text(json.dumps(data))
+    deflated = write_mind_file(str(tmp_path / "deflated.mind"), data)
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=True,
+        print_leaf_nodes=True,
+        id_scheme="node",
+    )
+
+    for path in (stored, extracted):
+        with extractor.read_map(str(path)) as map_bytes:
+            assert isinstance(map_bytes, memoryview)
+            assert json.loads(bytes(map_bytes)) == data
+    with extractor.read_map(deflated) as map_bytes:
+        assert isinstance(map_bytes, bytes)
+
+    expected = extractor.convert_bytes(deflated)
+    for path in (stored, extracted):
+        assert extractor.convert_bytes(str(path)) == expected
+        assert extractor.convert_bytes(str(path), stream=True) == expected
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_convert_exports_attachments(tmp_path, stream: bool):
+    data = generate_map(2, 2, attachments=2)
+    path = write_mind_file(str(tmp_path / "map.mind"), data, 64)
+    with zipfile.ZipFile(path, "a") as zip_file:
+        zip_file.writestr("attachments/9/unused.bin", b"unused")
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=False,
+        print_leaf_nodes=False,
+        attachments_dir=str(tmp_path / "files"),
+    )
+
+    output = extractor.convert_bytes(path, stream=stream)
+
+    rows = list(csv.reader(io.StringIO(output)))
+    first = tmp_path / "files" / "attachments" / "0" / "attachment-0.bin"
+    assert rows[0][0] == "1"
+    assert rows[0][2] == str(first)
+    assert rows[1][2] != "" and rows[2][2] == ""
+    assert first.stat().st_size == 64
+    assert sorted(
+        file.name for file in (tmp_path / "files").rglob("*.bin")
+    ) == ["attachment-0.bin", "attachment-1.bin"]
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_write_sinks_exports_attachments(tmp_path, stream: bool):
+    data = generate_map(2, 2, attachments=2)
+    path = write_mind_file(str(tmp_path / "map.mind"), data, 64)
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=False,
+        print_leaf_nodes=False,
+        attachments_dir=str(tmp_path / "files"),
+    )
+    output = io.StringIO()
+    sink = Sink(output, "ndjson", columns=["numbers", "attachment_files"])
+
+    extractor.write_sinks(path, [sink], stream)
+
+    rows = [json.loads(line) for line in output.getvalue().splitlines()]
+    first = tmp_path / "files" / "attachments" / "0" / "attachment-0.bin"
+    assert rows[0] == {"number": "1", "attachment_files": str(first)}
+    assert first.stat().st_size == 64
+    assert len(list((tmp_path / "files").rglob("*.bin"))) == 2
+
+
+def test_convert_refuses_attachment_bombs(tmp_path):
+    data = generate_map(1, 1, attachments=1)
+    path = tmp_path / "bomb.mind"
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        zip_file.writestr("map.json", json.dumps(data))
+        zip_file.writestr("attachments/0/attachment-0.bin", bytes(10 << 20))
+    extractor = MindMeisterExtractor(
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+        attachments_dir=str(tmp_path / "files"),
+    )
+
+    with pytest.raises(ExtractorError, match="compressed"):
+        extractor.convert_bytes(str(path))
+    extractor.max_compression_ratio = 1e6
+    extractor.max_attachment_bytes = 1 << 20
+    with pytest.raises(ExtractorError, match="bytes"):
+        extractor.convert_bytes(str(path))
+    assert not (tmp_path / "files").exists()
+
+
+def test_search_index(tmp_path, mind_file: str, data: Dict[str, Any]):
+    other = tmp_path / "other.mind"
+    data["root"]["children"][1]["title"] = "Budget 2024"
+    write_mind_file(str(other), data)
+
+    with SearchIndex(str(tmp_path / "index.db")) as index:
+        assert index.add(mind_file)
+        assert index.add(str(other))
+        assert not index.add(mind_file)
+
+        hits = index.search('sub AND "2.2"')
+        assert sorted((hit.numbers, hit.depth) for hit in hits) == [
+            ("1.2.2", 2),
+            ("1.2.2", 2),
+            ("1.2.2.1", 3),
+            ("1.2.2.1", 3),
+        ]
+        hit = index.search("budget")[0]
+        assert hit.map_path == str(other)
+        assert hit.path == ["root", "Budget 2024"]
+        assert index.search('"sub sub level 2.2.1"')[0].path == [
+            "root",
+            "level 2",
+            "sub level 2.2",
+            "sub sub level 2.2.1",
+        ]
+
+        data["root"]["children"][1]["title"] = "Forecast"
+        write_mind_file(str(other), data)
+        assert index.add(str(other))
+        assert index.search("budget") == []
+        assert len(index.search("forecast")) == 1
+
+        os.remove(other)
+        assert index.prune() == 1
+        assert index.search("forecast") == []
+        assert len(index.search("root")) == 1
+
+        with pytest.raises(ExtractorError):
+            index.search('"unbalanced')
+
+
+def test_write_sinks_sqlite(tmp_path, mind_file: str):
+    extractor = MindMeisterExtractor(
+        print_numbers=False,
+        print_ids=False,
+        print_leaf_nodes=False,
+        id_scheme="node",
+    )
+    path = str(tmp_path / "map.db")
+    # An earlier export is replaced.
+    extractor.write_sinks(mind_file, [SqliteSink(path)])
+    extractor.write_sinks(mind_file, [SqliteSink(path, closure=True)])
+
+    connection = sqlite3.connect(path)
+    rows = connection.execute(
+        "SELECT row, id, parent_id, parent, depth, number, leaf, title "
+        "FROM nodes ORDER BY row"
+    ).fetchall()
+    assert len(rows) == 10
+    assert rows[0] == (1, "2997460696", "0", None, 0, "1", 0, "root")
+    assert rows[3][3:] == (3, 3, "1.1.1.1", 1, "sub sub level 1.1.1")
+    assert rows[3][2] == rows[2][1]
+
+    subtree = connection.execute(
+        "SELECT nodes.number FROM closure JOIN nodes "
+        "ON nodes.row = closure.descendant "
+        "WHERE closure.ancestor = 6 AND closure.distance > 0 ORDER BY row"
+    ).fetchall()
+    assert subtree == [("1.2.1",), ("1.2.2",), ("1.2.2.1",)]
+    ancestors = connection.execute(
+        "SELECT ancestor, distance FROM closure WHERE descendant = 9 "
+        "ORDER BY distance"
+    ).fetchall()
+    assert ancestors == [(9, 0), (8, 1), (6, 2), (1, 3)]
+
+
+@pytest.mark.parametrize("id_scheme", ["node", "counter"])
+def test_write_csv_split_across_processes(tmp_path, id_scheme: str):
+    data = generate_map(3, 4, metadata=False)
+    # A node without a title still takes a counter id.
+    del data["root"]["children"][1]["children"][0]["title"]
+    path = write_mind_file(str(tmp_path / "map.mind"), data)
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=True,
+        print_leaf_nodes=True,
+        id_scheme=id_scheme,
+    )
+    pieces = extractor.split_map(data["root"], "0", jobs=2)
+    assert 1 < len(pieces) < 121
+    assert extractor.can_split()
+
+    output = io.StringIO()
+    extractor.write_csv(path, output, jobs=2)
+
+    assert output.getvalue() == extractor.convert_bytes(path)
+
+
+def test_folder_watcher(tmp_path, data: Dict[str, Any]):
+    watched = tmp_path / "exports"
+    (watched / "team").mkdir(parents=True)
+    output_dir = tmp_path / "csv"
+    path = str(watched / "team" / "map.mind")
+    write_mind_file(path, data)
+    watcher = FolderWatcher(
+        str(watched), str(output_dir), {"print_numbers": True}, settle=1.0
+    )
+
+    # A new file is only converted once it stopped changing.
+    assert watcher.poll(now=0.0) == []
+    assert watcher.poll(now=0.5) == []
+    results = watcher.poll(now=1.0)
+    assert [result.error for result in results] == [None]
+    with open(output_dir / "team" / "map.csv") as file:
+        assert file.readline() == "1,root\n"
+    assert watcher.poll(now=2.0) == []
+
+    # A touched file with the same content is not converted again.
+    os.utime(path, ns=(0, 0))
+    watcher.poll(now=3.0)
+    assert watcher.poll(now=4.0) == []
+    assert watcher.metrics["unchanged"] == 1
+
+    data["root"]["title"] = "new root"
+    write_mind_file(path, data)
+    watcher.poll(now=5.0)
+    results = watcher.poll(now=6.5)
+    assert len(results) == 1
+    with open(output_dir / "team" / "map.csv") as file:
+        assert file.readline() == "1,new root\n"
+    assert watcher.metrics["converted"] == 2
+    assert watcher.metrics["latency_seconds"] == 1.5
+    assert watcher.metrics["queued"] == 0
+
+
+def test_folder_watcher_retries_failed_files(tmp_path, data: Dict[str, Any]):
+    watched = tmp_path / "exports"
+    watched.mkdir()
+    output_dir = tmp_path / "csv"
+    # The output folder can not be created while a file is in the way.
+    output_dir.write_text("")
+    write_mind_file(str(watched / "map.mind"), data)
+    watcher = FolderWatcher(
+        str(watched), str(output_dir), {"print_numbers": True}, settle=1.0
+    )
+
+    watcher.poll(now=0.0)
+    results = watcher.poll(now=1.0)
+    assert len(results) == 1 and results[0].error is not None
+
+    output_dir.unlink()
+    results = watcher.poll(now=2.0)
+    assert [result.error for result in results] == [None]
+    with open(output_dir / "map.csv") as file:
+        assert file.readline() == "1,root\n"
+    assert watcher.metrics["failed"] == 1
+    assert watcher.metrics["converted"] == 1
+
+
+@pytest.mark.parametrize(
+    "extension, codec", [(".gz", gzip), (".bz2", bz2), (".xz", lzma)]
+)
+def test_convert_compressed_output(
+    tmp_path, mind_file: str, extension: str, codec
+):
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=False, print_leaf_nodes=False,
+    )
+    path = str(tmp_path / f"map.csv{extension}")
+    extractor.convert_file(mind_file, str(tmp_path / "map.csv"))
+    # Tiny chunks go through the compressor queue many times.
+    extractor.convert_file(mind_file, path, buffer_size=8, compression_level=1)
+
+    with codec.open(path, "rb") as file:
+        assert file.read() == (tmp_path / "map.csv").read_bytes()
+
+
+@pytest.mark.parametrize(
+    "shard_by, shard_rows, shards",
+    [
+        (
+            "branch",
+            None,
+            [
+                ("map-1-root.csv", "1", 1),
+                ("map-1.1-level_1.csv", "1.1", 4),
+                ("map-1.2-level_2.csv", "1.2", 4),
+                ("map-1.3-level_3.csv", "1.3", 1),
+            ],
+        ),
+        (
+            "rows",
+            4,
+            [
+                ("map-0001.csv", "1", 4),
+                # 1.2 and 1.2.1 fit after 1.1.2, 1.2.2 and its child do not
+                # and the shard does not end with 1.2.2.
+                ("map-0002.csv", "1.1.2", 3),
+                ("map-0003.csv", "1.2.2", 3),
+            ],
+        ),
+        (
+            "rows",
+            3,
+            [
+                # The first leaf is 4 rows deep, this run has to be split.
+                ("map-0001.csv", "1", 3),
+                ("map-0002.csv", "1.1.1.1", 2),
+                ("map-0003.csv", "1.2", 2),
+                ("map-0004.csv", "1.2.2", 3),
+            ],
+        ),
+    ],
+)
+def test_write_shards(
+    tmp_path, mind_file: str, shard_by: str, shard_rows, shards: List
+):
+    extractor = MindMeisterExtractor(
+        print_numbers=True, print_ids=False, print_leaf_nodes=False,
+    )
+    manifest = extractor.write_shards(
+        mind_file, str(tmp_path / "map.csv"), shard_by, shard_rows
+    )
+
+    assert [
+        (shard["path"], shard["first"], shard["rows"])
+        for shard in manifest["shards"]
+    ] == shards
+    assert manifest["rows"] == 10
+    with open(tmp_path / "map.manifest.json") as file:
+        assert json.load(file) == manifest
+
+    output = b""
+    for shard in manifest["shards"]:
+        content = (tmp_path / shard["path"]).read_bytes()
+        assert hashlib.sha256(content).hexdigest() == shard["sha256"]
+        output += content
+    assert output.decode() == extractor.convert_bytes(mind_file)
+
+
+def test_write_shards_needs_row_count(tmp_path, mind_file: str):
+    extractor = MindMeisterExtractor(
+        print_numbers=False, print_ids=False, print_leaf_nodes=False,
+    )
+    with pytest.raises(ExtractorError):
+        extractor.write_shards(mind_file, str(tmp_path / "map.csv"), "rows")
+
+
+def test_write_csv_split_from_many_threads(tmp_path):
+    extractor = MindMeisterExtractor(
+        print_numbers=True,
+        print_ids=True,
+        print_leaf_nodes=False,
+        id_scheme="counter",
+    )
+    paths = []
+    for breadth in (3, 4):
+        data = generate_map(breadth, 4, metadata=False)
+        path = str(tmp_path / f"map-{breadth}.mind")
+        paths.append(write_mind_file(path, data))
+    expected = [extractor.convert_bytes(path) for path in paths]
+
+    def convert(path: str) -> str:
+        output = io.StringIO()
+        extractor.write_csv(path, output, jobs=2)
+        return output.getvalue()
+
+    with ThreadPoolExecutor(4) as executor:
+        outputs = list(executor.map(convert, paths * 3))
+
+    assert outputs == expected * 3